@@ -30,8 +30,18 @@ bl_info = {
 
 
 import bpy
+import argparse
+import concurrent.futures
+import hashlib
+import json
 import math
+import os
+import subprocess
+import sys
+import numpy as np
 from bpy.props import *
+from bpy_extras.io_utils import ImportHelper
+from mathutils import Vector
 
 def Generate(origin):
     print("Starting car rig generation...")
@@ -42,19 +52,22 @@ def Generate(origin):
     amt = ob.data
 
 
+    # read the meta rig bone positions once instead of looking them up for each new bone
+    heads = {name: bone.head_local.copy() for name, bone in amt.bones.items()}
+
     bpy.ops.object.mode_set(mode='EDIT')
     #####################################Computing Average Positions#################################
-    posx = (ob.data.bones['FRWheel'].head_local[0] + ob.data.bones['FLWheel'].head_local[0]) /2
-    posy = (ob.data.bones['FRWheel'].head_local[1] + ob.data.bones['FLWheel'].head_local[1]) /2
-    posz = (ob.data.bones['FRWheel'].head_local[2] + ob.data.bones['FLWheel'].head_local[2]) /2
+    posx = (heads['FRWheel'][0] + heads['FLWheel'][0]) /2
+    posy = (heads['FRWheel'][1] + heads['FLWheel'][1]) /2
+    posz = (heads['FRWheel'][2] + heads['FLWheel'][2]) /2
 
-    pos2x = (ob.data.bones['BRWheel'].head_local[0] + ob.data.bones['BLWheel'].head_local[0]) /2
-    pos2y = (ob.data.bones['BRWheel'].head_local[1] + ob.data.bones['BLWheel'].head_local[1]) /2
-    pos2z = (ob.data.bones['BRWheel'].head_local[2] + ob.data.bones['BLWheel'].head_local[2]) /2
+    pos2x = (heads['BRWheel'][0] + heads['BLWheel'][0]) /2
+    pos2y = (heads['BRWheel'][1] + heads['BLWheel'][1]) /2
+    pos2z = (heads['BRWheel'][2] + heads['BLWheel'][2]) /2
 
-    pos3x = ob.data.bones['Body'].head_local[0]
-    pos3y = ob.data.bones['Body'].head_local[1]
-    pos3z = ob.data.bones['Body'].head_local[2]
+    pos3x = heads['Body'][0]
+    pos3y = heads['Body'][1]
+    pos3z = heads['Body'][2]
 
 
     #####################################Create Bones#################################
@@ -67,7 +80,7 @@ def Generate(origin):
     axis.layers[0] = False
 
     damperCenter = amt.edit_bones.new("damperCenter")
-    damperCenter.head = ob.data.bones['Body'].head_local
+    damperCenter.head = heads['Body']
     damperCenter.tail = (pos3x,pos3y-1,pos3z)
     damperCenter.layers[30] = True
     damperCenter.layers[0] = False
@@ -109,14 +122,14 @@ def Generate(origin):
     steeringWheel.tail = (posx,posy-2.5,posz)
 
     damperFront = amt.edit_bones.new("damperFront")
-    damperFront.head = ob.data.bones['FRWheel'].head_local
-    damperFront.tail = ob.data.bones['FLWheel'].head_local
+    damperFront.head = heads['FRWheel']
+    damperFront.tail = heads['FLWheel']
     damperFront.layers[30] = True
     damperFront.layers[0] = False
 
     damperBack = amt.edit_bones.new("damperBack")
-    damperBack.head = ob.data.bones['BRWheel'].head_local
-    damperBack.tail = ob.data.bones['BLWheel'].head_local
+    damperBack.head = heads['BRWheel']
+    damperBack.tail = heads['BLWheel']
     damperBack.layers[30] = True
     damperBack.layers[0] = False
 
@@ -126,31 +139,31 @@ def Generate(origin):
     damper.parent = damperCenter
 
     FRSensor = amt.edit_bones.new("FRSensor")
-    FRSensor.head = ob.data.bones['FRWheel'].head_local
-    FRSensor.tail = ob.data.bones['FRWheel'].head_local
+    FRSensor.head = heads['FRWheel']
+    FRSensor.tail = heads['FRWheel']
     FRSensor.tail[2] = FRSensor.tail.z+0.3
     FRSensor.parent = damperCenter
 
     FLSensor = amt.edit_bones.new("FLSensor")
-    FLSensor.head = ob.data.bones['FLWheel'].head_local
-    FLSensor.tail = ob.data.bones['FLWheel'].head_local
+    FLSensor.head = heads['FLWheel']
+    FLSensor.tail = heads['FLWheel']
     FLSensor.tail[2] = FLSensor.tail.z+0.3
     FLSensor.parent = damperCenter
 
     BRSensor = amt.edit_bones.new("BRSensor")
-    BRSensor.head = ob.data.bones['BRWheel'].head_local
-    BRSensor.tail = ob.data.bones['BRWheel'].head_local
+    BRSensor.head = heads['BRWheel']
+    BRSensor.tail = heads['BRWheel']
     BRSensor.tail[2] = BRSensor.tail.z+0.3
 
     BLSensor = amt.edit_bones.new("BLSensor")
-    BLSensor.head = ob.data.bones['BLWheel'].head_local
-    BLSensor.tail = ob.data.bones['BLWheel'].head_local
+    BLSensor.head = heads['BLWheel']
+    BLSensor.tail = heads['BLWheel']
     BLSensor.tail[2] = BLSensor.tail.z+0.3
     BLSensor.parent = damperCenter
 
     WheelRot = amt.edit_bones.new("WheelRot")
-    WheelRot.head = ob.data.bones['FLWheel'].head_local
-    WheelRot.tail = ob.data.bones['FLWheel'].head_local
+    WheelRot.head = heads['FLWheel']
+    WheelRot.tail = heads['FLWheel']
     WheelRot.tail[1] = FLSensor.tail.y+0.3
     WheelRot.parent = damperCenter
 
@@ -396,6 +409,21 @@ def Generate(origin):
     empty.show_x_ray = True
     empty.empty_draw_type = "ARROWS"
 
+    AddWheelDriver(ob, empty)
+
+    # parent body bone
+    ob.parent = empty
+
+    bpy.ops.object.select_all(action="TOGGLE")
+    ob.select = True
+
+    print("Generate Finished")
+
+
+
+def AddWheelDriver(ob, empty):
+    """Drive the FLWheel rotation with the distance travelled by the car driver empty"""
+    FLWheel = ob.pose.bones['FLWheel']
     FLWheel.rotation_mode = "XYZ"
 
     fcurve = FLWheel.driver_add('rotation_euler', 0)
@@ -412,20 +440,12 @@ def Generate(origin):
 
     fmod = fcurve.modifiers[0]
     fmod.mode = 'POLYNOMIAL'
-    fmod.poly_order = 1
-    if FLWheel.head.z <= 0:
-        fmod.coefficients = (0, 1)
+    fmod.poly_order = 1
+    if FLWheel.head.z <= 0:
+        fmod.coefficients = (0, 1)
     else:
         fmod.coefficients = (0, 1/FLWheel.head.z)
-
-    # parent body bone
-    ob.parent = empty
-
-    bpy.ops.object.select_all(action="TOGGLE")
-    ob.select = True
-
-    print("Generate Finished")
-
+    return fcurve
 
 
 def CreateCarMetaRig(origin):       #create Car meta rig
@@ -467,6 +487,605 @@ def CreateCarMetaRig(origin):       #create Car meta rig
     bpy.ops.object.mode_set(mode='OBJECT')
 
 
+#####################################Ground contact#################################
+SENSORS = ('FLSensor', 'FRSensor', 'BLSensor', 'BRSensor')
+
+# Height field tiles already loaded (memory-mapped), by file path
+height_fields = {}
+# Samples along each side of a height field tile, the tiles are aligned on the world origin
+HEIGHT_TILE = 64
+
+
+def remove_fcurve(action, data_path, index):
+    for fcurve in action.fcurves:
+        if fcurve.data_path == data_path and fcurve.array_index == index:
+            action.fcurves.remove(fcurve)
+            break
+
+
+def write_keyframes(action, data_path, index, frames, values, group):
+    """Replace the fcurve data_path[index] of the action with linear keyframes"""
+    remove_fcurve(action, data_path, index)
+    fcurve = action.fcurves.new(data_path, index, group)
+    fcurve.keyframe_points.add(len(frames))
+    co = np.empty(2 * len(frames))
+    co[0::2] = frames
+    co[1::2] = values
+    fcurve.keyframe_points.foreach_set('co', co)
+    for keyframe in fcurve.keyframe_points:
+        keyframe.interpolation = 'LINEAR'
+    fcurve.update()
+    return fcurve
+
+
+def get_action(ob):
+    if ob.animation_data is None:
+        ob.animation_data_create()
+    if ob.animation_data.action is None:
+        ob.animation_data.action = bpy.data.actions.new(ob.name + "Action")
+    return ob.animation_data.action
+
+
+def compose_matrices(location, euler, scale):
+    """Return the matrices (n, 4, 4) for arrays (n, 3) of locations, XYZ eulers and scales"""
+    cx, cy, cz = np.cos(euler).T
+    sx, sy, sz = np.sin(euler).T
+    matrices = np.zeros((len(location), 4, 4))
+    matrices[:, 0, 0] = cy * cz
+    matrices[:, 0, 1] = sx * sy * cz - cx * sz
+    matrices[:, 0, 2] = cx * sy * cz + sx * sz
+    matrices[:, 1, 0] = cy * sz
+    matrices[:, 1, 1] = sx * sy * sz + cx * cz
+    matrices[:, 1, 2] = cx * sy * sz - sx * cz
+    matrices[:, 2, 0] = -sy
+    matrices[:, 2, 1] = sx * cy
+    matrices[:, 2, 2] = cx * cy
+    matrices[:, :3, :3] *= scale[:, np.newaxis, :]
+    matrices[:, :3, 3] = location
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+def object_matrices(scene, obj, frames):
+    """Return the world matrices (n, 4, 4) of an object for the given frames.
+
+    An unparented and unconstrained object is evaluated from its fcurves only,
+    otherwise the scene is updated for each frame.
+    """
+    animation_data = obj.animation_data
+    if (obj.parent is None and not obj.constraints and obj.rotation_mode == 'XYZ'
+            and (animation_data is None or not animation_data.drivers)):
+        channels = {'location': 0, 'rotation_euler': 3, 'scale': 6}
+        values = np.empty((len(frames), 9))
+        values[:] = tuple(obj.location) + tuple(obj.rotation_euler) + tuple(obj.scale)
+        if animation_data is not None and animation_data.action is not None:
+            for fcurve in animation_data.action.fcurves:
+                if fcurve.data_path in channels and fcurve.array_index < 3:
+                    evaluate = fcurve.evaluate
+                    values[:, channels[fcurve.data_path] + fcurve.array_index] = [evaluate(f) for f in frames]
+        return compose_matrices(values[:, 0:3], values[:, 3:6], values[:, 6:9])
+
+    current_frame = scene.frame_current
+    matrices = np.empty((len(frames), 4, 4))
+    for i, frame in enumerate(frames):
+        scene.frame_set(int(frame))
+        matrices[i] = np.array(obj.matrix_world)
+    scene.frame_set(current_frame)
+    return matrices
+
+
+def terrain_top(terrain):
+    """Return the highest world z of the terrain bounding box"""
+    return max((terrain.matrix_world * Vector(corner)).z for corner in terrain.bound_box)
+
+
+def drive_region(x, y, margin, step):
+    """Return the grid bounds (min x, min y, max x, max y) covering the positions x, y plus a margin, aligned on step"""
+    return (math.floor((np.min(x) - margin) / step) * step, math.floor((np.min(y) - margin) / step) * step,
+            math.ceil((np.max(x) + margin) / step) * step, math.ceil((np.max(y) + margin) / step) * step)
+
+
+def terrain_digest(terrain, step):
+    """Hash of the terrain mesh with its modifiers applied, its world matrix and the grid step"""
+    if terrain.modifiers:
+        mesh = terrain.to_mesh(bpy.context.scene, True, 'PREVIEW')
+    else:
+        mesh = terrain.data
+    coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', coords)
+    if mesh is not terrain.data:
+        bpy.data.meshes.remove(mesh)
+    digest = hashlib.sha1(coords.tobytes())
+    digest.update(np.array(terrain.matrix_world, dtype=np.float32).tobytes())
+    digest.update(np.array([step], dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def build_height_field(terrain, region, step):
+    """Sample the terrain heights (world z) on a regular grid covering the region.
+
+    Rows are along y, columns along x, NaN where the terrain is missed.
+    """
+    min_x, min_y, max_x, max_y = region
+    nx = max(2, int(round((max_x - min_x) / step)) + 1)
+    ny = max(2, int(round((max_y - min_y) / step)) + 1)
+    heights = np.full((ny, nx), np.nan, dtype=np.float32)
+
+    top = terrain_top(terrain) + 1
+    to_local = terrain.matrix_world.inverted()
+    direction = to_local.to_3x3() * Vector((0, 0, -1))
+    ray_cast = terrain.ray_cast
+    for j in range(ny):
+        y = min_y + j * step
+        for i in range(nx):
+            hit, location, normal, index = ray_cast(to_local * Vector((min_x + i * step, y, top)), direction)
+            if hit:
+                heights[j, i] = (terrain.matrix_world * location).z
+    return heights
+
+
+def get_height_tile(terrain, directory, tx, ty, step):
+    """Return the tile (tx, ty) of the terrain height field, built once and saved in directory"""
+    path = os.path.join(directory, "%d_%d.npy" % (tx, ty))
+    tile = height_fields.get(path)
+    if tile is None:
+        if os.path.exists(path):
+            tile = np.load(path, mmap_mode='r')
+        else:
+            x, y = tx * HEIGHT_TILE * step, ty * HEIGHT_TILE * step
+            size = (HEIGHT_TILE - 1) * step
+            tile = build_height_field(terrain, (x, y, x + size, y + size), step)
+            try:
+                os.makedirs(directory, exist_ok=True)
+                np.save(path, tile)
+            except OSError:
+                # read-only directory: the tile is only kept for this session
+                pass
+        height_fields[path] = tile
+    return tile
+
+
+def get_height_field(terrain, region, step):
+    """Return the height field of the terrain over the region (aligned on step).
+
+    The height field is assembled from tiles cached next to the .blend file by terrain and step,
+    so the cars driving on the same terrain share the tiles.
+    """
+    digest = terrain_digest(terrain, step)
+    directory = bpy.path.abspath("//") if bpy.data.filepath else bpy.app.tempdir
+    directory = os.path.join(directory, "%s.%s.heights" % (bpy.path.clean_name(terrain.name), digest[:16]))
+    i0, j0, i1, j1 = (int(round(bound / step)) for bound in region)
+    i1, j1 = max(i1, i0 + 1), max(j1, j0 + 1)
+    heights = np.empty((j1 - j0 + 1, i1 - i0 + 1), dtype=np.float32)
+    for ty in range(j0 // HEIGHT_TILE, j1 // HEIGHT_TILE + 1):
+        for tx in range(i0 // HEIGHT_TILE, i1 // HEIGHT_TILE + 1):
+            tile = get_height_tile(terrain, directory, tx, ty, step)
+            # intersection of the tile and the region, in grid indices
+            x0, x1 = max(i0, tx * HEIGHT_TILE), min(i1, (tx + 1) * HEIGHT_TILE - 1)
+            y0, y1 = max(j0, ty * HEIGHT_TILE), min(j1, (ty + 1) * HEIGHT_TILE - 1)
+            heights[y0 - j0:y1 - j0 + 1, x0 - i0:x1 - i0 + 1] = tile[y0 - ty * HEIGHT_TILE:y1 - ty * HEIGHT_TILE + 1,
+                                                                    x0 - tx * HEIGHT_TILE:x1 - tx * HEIGHT_TILE + 1]
+    return heights
+
+
+def sample_height_field(heights, origin, step, x, y):
+    """Bilinear interpolation of the height field at world positions x, y (arrays of any shape)"""
+    ny, nx = heights.shape
+    gx = (x - origin[0]) / step
+    gy = (y - origin[1]) / step
+    ix = np.clip(np.floor(gx).astype(int), 0, nx - 2)
+    iy = np.clip(np.floor(gy).astype(int), 0, ny - 2)
+    fx = np.clip(gx - ix, 0, 1)
+    fy = np.clip(gy - iy, 0, 1)
+    bottom = heights[iy, ix] * (1 - fx) + heights[iy, ix + 1] * fx
+    top = heights[iy + 1, ix] * (1 - fx) + heights[iy + 1, ix + 1] * fx
+    return bottom * (1 - fy) + top * fy
+
+
+def BakeGroundContact(ob, frames, step):
+    """Key the wheel sensors on the ground of their Shrinkwrap target and mute the Shrinkwrap constraints"""
+    scene = bpy.context.scene
+    shrinkwraps = [next((c for c in ob.pose.bones[name].constraints if c.type == 'SHRINKWRAP'), None) for name in SENSORS]
+    terrain = shrinkwraps[0].target if shrinkwraps[0] is not None else None
+    if terrain is None or terrain.type != 'MESH':
+        return False
+
+    # rig world matrices, the rig follows carDriver
+    rig_local = np.array(ob.matrix_parent_inverse * ob.matrix_basis)
+    matrices = np.matmul(object_matrices(scene, ob.parent, frames), rig_local)
+
+    sensor_heads = np.array([tuple(ob.data.bones[name].head_local) for name in SENSORS])
+    world = np.einsum('fij,sj->fsi', matrices[:, :3, :3], sensor_heads) + matrices[:, np.newaxis, :3, 3]
+
+    # only sample the terrain around the drive, with a wheelbase margin
+    wheelbase = np.linalg.norm((sensor_heads[0] + sensor_heads[1] - sensor_heads[2] - sensor_heads[3]) / 2)
+    region = drive_region(world[..., 0], world[..., 1], wheelbase, step)
+    heights = get_height_field(terrain, region, step)
+
+    ground = np.empty(world.shape[:2] + (4,))
+    ground[..., :2] = world[..., :2]
+    ground[..., 2] = sample_height_field(heights, region[:2], step, world[..., 0], world[..., 1])
+    ground[..., 3] = 1
+    ground_z = np.einsum('fij,fsj->fsi', np.linalg.inv(matrices), ground)[..., 2]
+
+    action = get_action(ob)
+    for s, name in enumerate(SENSORS):
+        # the sensor bone points up: its local Y axis is the armature Z axis
+        distance = shrinkwraps[s].distance if shrinkwraps[s] is not None else sensor_heads[s, 2]
+        location = np.nan_to_num(ground_z[:, s] + distance - sensor_heads[s, 2])
+        write_keyframes(action, 'pose.bones["%s"].location' % name, 1, frames, location, name)
+        if shrinkwraps[s] is not None:
+            shrinkwraps[s].mute = True
+    return True
+
+
+#####################################Telemetry import#################################
+# Bytes of the telemetry file read and parsed at once
+TELEMETRY_BLOCK = 1 << 23
+EARTH_RADIUS = 6371000.0
+# Required columns: time (s), latitude and longitude (degrees), heading (degrees clockwise from north) and speed (m/s)
+TELEMETRY_COLUMNS = ('time', 'latitude', 'longitude', 'heading', 'speed')
+# Optional suspension travel columns (m, positive when compressed)
+SUSPENSION_COLUMNS = ('susp_fl', 'susp_fr', 'susp_bl', 'susp_br')
+
+
+def parse_csv_block(block, nb_columns):
+    """Parse complete CSV lines (bytes) in one call, return an array (lines, nb_columns)"""
+    text = block.replace(b"\r", b"").strip().replace(b"\n", b",")
+    try:
+        values = np.fromstring(text, sep=",")
+    except ValueError:
+        values = None
+    if values is None or len(values) != text.count(b",") + 1:
+        # blank lines: drop them and parse again
+        text = b",".join(line for line in block.replace(b"\r", b"").split(b"\n") if line.strip())
+        values = np.fromstring(text, sep=",")
+    return values.reshape(-1, nb_columns)
+
+
+def ReadTelemetry(filepath, fps):
+    """Stream a telemetry CSV file and resample it at fps.
+
+    Return an array (frames, n) with the columns time, x, y (metres from the first position),
+    heading (radians, unwrapped), speed and the suspension travels when available.
+    """
+    with open(filepath, "rb") as telemetry:
+        header = [name.strip().lower() for name in telemetry.readline().decode().split(",")]
+        missing = [name for name in TELEMETRY_COLUMNS if name not in header]
+        if missing:
+            raise ValueError("Missing telemetry columns: %s" % ", ".join(missing))
+        columns = list(TELEMETRY_COLUMNS)
+        if all(name in header for name in SUSPENSION_COLUMNS):
+            columns.extend(SUSPENSION_COLUMNS)
+        indices = [header.index(name) for name in columns]
+
+        origin = None
+        previous = None
+        next_frame = 0
+        resampled = []
+        tail = b""
+        while True:
+            # parse the complete lines of the block, the incomplete last line is kept for the next block
+            block = telemetry.read(TELEMETRY_BLOCK)
+            if block:
+                block = tail + block
+                end = block.rfind(b"\n") + 1
+                block, tail = block[:end], block[end:]
+            elif tail:
+                block, tail = tail, b""
+            else:
+                break
+            samples = parse_csv_block(block, len(header))
+            if len(samples) == 0:
+                continue
+            samples = samples[:, indices]
+            if origin is None:
+                origin = samples[0, :3].copy()
+
+            # local coordinates (equirectangular projection around the first position)
+            latitude = np.radians(samples[:, 1])
+            longitude = np.radians(samples[:, 2])
+            samples[:, 1] = EARTH_RADIUS * (longitude - math.radians(origin[2])) * math.cos(math.radians(origin[1]))
+            samples[:, 2] = EARTH_RADIUS * (latitude - math.radians(origin[1]))
+            samples[:, 3] = np.radians(samples[:, 3])
+
+            # keep the last sample of the previous chunk to interpolate across chunks
+            if previous is not None:
+                samples = np.concatenate((previous, samples))
+            samples[:, 3] = np.unwrap(samples[:, 3])
+            previous = samples[-1:]
+
+            last_frame = int(math.floor((samples[-1, 0] - origin[0]) * fps))
+            if last_frame < next_frame:
+                continue
+            times = origin[0] + np.arange(next_frame, last_frame + 1) / fps
+            frame_values = np.empty((len(times), len(columns)))
+            frame_values[:, 0] = times
+            for c in range(1, len(columns)):
+                frame_values[:, c] = np.interp(times, samples[:, 0], samples[:, c])
+            resampled.append(frame_values)
+            next_frame = last_frame + 1
+
+    if not resampled:
+        raise ValueError("No telemetry samples")
+    return np.concatenate(resampled)
+
+
+def bone_axis(ob, name, axis):
+    """Return the pose location of a bone moving it by one unit along an armature axis"""
+    return np.array(ob.data.bones[name].matrix_local.to_3x3().inverted() * Vector(axis))
+
+
+def ImportTelemetry(ob, filepath):
+    """Key carDriver, steeringWheel and damper of a generated rig from a telemetry CSV file"""
+    scene = bpy.context.scene
+    fps = scene.render.fps / scene.render.fps_base
+    telemetry = ReadTelemetry(filepath, fps)
+    frames = scene.frame_start + np.arange(len(telemetry), dtype=float)
+    scale = scene.unit_settings.scale_length or 1.0
+
+    # carDriver: the rig front is along -Y
+    empty = ob.parent
+    action = get_action(empty)
+    heading = telemetry[:, 3]
+    rotation = math.pi - heading
+    write_keyframes(action, 'location', 0, frames, telemetry[:, 1] / scale, "Object Transforms")
+    write_keyframes(action, 'location', 1, frames, telemetry[:, 2] / scale, "Object Transforms")
+    write_keyframes(action, 'rotation_euler', 2, frames, rotation, "Object Transforms")
+
+    # steeringWheel: offset of the steering target for the path curvature (bicycle model)
+    heads = {name: np.array(bone.head_local) for name, bone in ob.data.bones.items()}
+    wheelbase = np.linalg.norm((heads['FLWheel'] + heads['FRWheel'] - heads['BLWheel'] - heads['BRWheel']) / 2) * scale
+    steering_distance = np.linalg.norm(heads['steeringWheel'] - heads['wheelFront'])
+    yaw_rate = np.gradient(rotation) * fps if len(rotation) > 1 else np.zeros(len(rotation))
+    speed = telemetry[:, 4]
+    curvature = np.where(speed > 0.5, yaw_rate / np.maximum(speed, 0.5), 0)
+    # turning left moves the target along +X (left side of the car)
+    steering = steering_distance * wheelbase * curvature
+
+    action = get_action(ob)
+    channels = [('steeringWheel', bone_axis(ob, 'steeringWheel', (1, 0, 0)) * steering[:, np.newaxis])]
+    if telemetry.shape[1] == len(TELEMETRY_COLUMNS):
+        # no suspension data: drop the damper curves of a previous import
+        for index in range(3):
+            remove_fcurve(action, 'pose.bones["damper"].location', index)
+    else:
+        fl, fr, bl, br = (telemetry[:, c] / scale for c in range(len(TELEMETRY_COLUMNS), len(TELEMETRY_COLUMNS) + 4))
+        # damper X: roll, Y: pitch, Z: heave (armature space)
+        damper = (np.outer((fr + br - fl - bl) / 2, bone_axis(ob, 'damper', (1, 0, 0)))
+                  + np.outer((bl + br - fl - fr) / 2, bone_axis(ob, 'damper', (0, 1, 0)))
+                  - np.outer((fl + fr + bl + br) / 4, bone_axis(ob, 'damper', (0, 0, 1))))
+        channels.append(('damper', damper))
+    for name, location in channels:
+        for index in range(3):
+            write_keyframes(action, 'pose.bones["%s"].location' % name, index, frames, location[:, index], name)
+    return len(frames)
+
+
+#####################################Wheel spin#################################
+WHEELS = ('FLWheel', 'FRWheel', 'BLWheel', 'BRWheel')
+
+
+def BakeWheelSpin(ob, frames):
+    """Replace the FLWheel spin driver and the wheels rotation copies with precomputed spin curves.
+
+    The spin integrates the distance travelled along the rig Y axis, so reversing turns the wheels backward.
+    """
+    scene = bpy.context.scene
+    driver = None
+    if ob.animation_data is not None:
+        driver = next((d for d in ob.animation_data.drivers if d.data_path == 'pose.bones["FLWheel"].rotation_euler' and d.array_index == 0), None)
+    if driver is not None and len(driver.modifiers) and driver.modifiers[0].coefficients[1] != 0:
+        radius = 1 / driver.modifiers[0].coefficients[1]
+    else:
+        radius = ob.get("precomputedSpinRadius") or ob.data.bones['FLWheel'].head_local.z
+    if radius <= 0:
+        radius = 1
+
+    rig_local = np.array(ob.matrix_parent_inverse * ob.matrix_basis)
+    matrices = np.matmul(object_matrices(scene, ob.parent, frames), rig_local)
+    y_axis = matrices[:, :3, 1] / np.linalg.norm(matrices[:, :3, 1], axis=1)[:, np.newaxis]
+    steps = np.diff(matrices[:, :3, 3], axis=0)
+    distances = np.einsum('ij,ij->i', steps, (y_axis[1:] + y_axis[:-1]) / 2)
+    spin = np.concatenate(([0], np.cumsum(distances))) / radius
+
+    if driver is not None:
+        ob.driver_remove('pose.bones["FLWheel"].rotation_euler', 0)
+    action = get_action(ob)
+    for name in WHEELS:
+        wheel = ob.pose.bones[name]
+        wheel.rotation_mode = "XYZ"
+        for cns in [c for c in wheel.constraints if c.type == 'COPY_ROTATION' and c.subtarget == 'FLWheel']:
+            wheel.constraints.remove(cns)
+        write_keyframes(action, 'pose.bones["%s"].rotation_euler' % name, 0, frames, spin, name)
+    ob["precomputedSpinRadius"] = radius
+
+
+#####################################Rig validation#################################
+# Constraint types of the rig bones, as created by Generate()
+EXPECTED_CONSTRAINTS = {
+    'axis': ['COPY_LOCATION', 'TRACK_TO', 'DAMPED_TRACK'],
+    'Body': ['TRANSFORM', 'TRANSFORM'],
+    'damperCenter': [],
+    'damper': [],
+    'damperFront': ['COPY_LOCATION', 'TRACK_TO'],
+    'damperBack': ['COPY_LOCATION', 'TRACK_TO'],
+    'wheelFront': ['LOCKED_TRACK'],
+    'steeringWheel': [],
+    'WheelRot': ['COPY_LOCATION'],
+    'FLWheel': ['COPY_LOCATION', 'DAMPED_TRACK', 'COPY_LOCATION', 'COPY_ROTATION'],
+    'FRWheel': ['COPY_LOCATION', 'DAMPED_TRACK', 'COPY_ROTATION', 'COPY_ROTATION'],
+    'BLWheel': ['COPY_LOCATION', 'DAMPED_TRACK', 'COPY_LOCATION', 'COPY_ROTATION'],
+    'BRWheel': ['COPY_LOCATION', 'DAMPED_TRACK', 'COPY_LOCATION', 'COPY_ROTATION'],
+    'FLSensor': ['SHRINKWRAP'],
+    'FRSensor': ['SHRINKWRAP'],
+    'BLSensor': ['SHRINKWRAP'],
+    'BRSensor': ['SHRINKWRAP'],
+}
+
+# Constraint types of the wheels once their spin is precomputed by BakeWheelSpin()
+PRECOMPUTED_SPIN_CONSTRAINTS = {
+    'FRWheel': ['COPY_LOCATION', 'DAMPED_TRACK', 'COPY_ROTATION'],
+    'BLWheel': ['COPY_LOCATION', 'DAMPED_TRACK', 'COPY_LOCATION'],
+    'BRWheel': ['COPY_LOCATION', 'DAMPED_TRACK', 'COPY_LOCATION'],
+}
+
+# Bones of a meta rig created by CreateCarMetaRig(), before Generate()
+META_RIG_BONES = {'Body', 'FLWheel', 'FRWheel', 'BLWheel', 'BRWheel'}
+
+# Marker of the validation report in the output of a worker process
+REPORT_PREFIX = "CAR_RIG_REPORT:"
+# Last lines of the output of a failed worker process kept in the report
+WORKER_OUTPUT_LINES = 20
+
+
+def ValidateRig(ob, repair=False, ground=None):
+    """Check a generated car rig against the structure created by Generate().
+
+    Return a dict listing the problems found and, if repair is True, the ones repaired.
+    """
+    report = {"rig": ob.name, "problems": [], "repaired": []}
+
+    def problem(message, fix=None):
+        report["problems"].append(message)
+        if repair and fix is not None:
+            fix()
+            report["repaired"].append(message)
+
+    if set(ob.data.bones.keys()) == META_RIG_BONES:
+        report["meta_rig"] = True
+        return report
+
+    precomputed_spin = "precomputedSpinRadius" in ob
+    expected_constraints = dict(EXPECTED_CONSTRAINTS)
+    if precomputed_spin:
+        expected_constraints.update(PRECOMPUTED_SPIN_CONSTRAINTS)
+
+    missing_bones = [name for name in expected_constraints if name not in ob.pose.bones]
+    for name in missing_bones:
+        problem("missing bone %s" % name)
+    for name, types in expected_constraints.items():
+        if name not in missing_bones:
+            found = [c.type for c in ob.pose.bones[name].constraints]
+            if found != types:
+                problem("unexpected constraints on %s: %s" % (name, ", ".join(found) or "none"))
+
+    for name in SENSORS:
+        if name in missing_bones:
+            continue
+        for cns in ob.pose.bones[name].constraints:
+            if cns.type == 'SHRINKWRAP' and cns.target is None:
+                def set_target(cns=cns):
+                    cns.target = ground
+                problem("untargeted Shrinkwrap on %s" % name, set_target if ground is not None else None)
+
+    # carDriver parent
+    empty = ob.parent
+    if empty is None or empty.type != 'EMPTY':
+        # only a car driver not driving another rig can be the lost parent, and only if it is the only one
+        drivers = set(other.parent for other in bpy.data.objects if other.parent is not None and "metaCarRig" in other)
+        candidates = [other for other in bpy.data.objects
+                      if other.type == 'EMPTY' and other.name.startswith("carDriver") and other not in drivers]
+        if len(candidates) == 1:
+            candidate = candidates[0]
+
+            def set_parent():
+                # Generate() leaves the parent inverse matrix to identity
+                ob.parent = candidate
+                ob.matrix_parent_inverse.identity()
+            problem("rig not parented to carDriver", set_parent)
+            empty = candidate if repair else None
+        else:
+            problem("rig not parented to carDriver")
+            empty = None
+
+    # wheel spin curves or FLWheel spin driver
+    if precomputed_spin:
+        action = ob.animation_data.action if ob.animation_data is not None else None
+        spin_paths = set(fc.data_path for fc in action.fcurves if fc.array_index == 0) if action is not None else set()
+        for name in WHEELS:
+            if 'pose.bones["%s"].rotation_euler' % name not in spin_paths:
+                problem("missing spin curve on %s" % name)
+    elif 'FLWheel' not in missing_bones:
+        drivers = ob.animation_data.drivers if ob.animation_data is not None else ()
+        fcurve = next((d for d in drivers if d.data_path == 'pose.bones["FLWheel"].rotation_euler' and d.array_index == 0), None)
+        fix = (lambda: AddWheelDriver(ob, empty)) if empty is not None else None
+        if fcurve is None:
+            problem("missing FLWheel driver", fix)
+        else:
+            variables = fcurve.driver.variables
+            if len(variables) == 0 or variables[0].targets[0].id is None:
+                def retarget():
+                    ob.driver_remove('pose.bones["FLWheel"].rotation_euler', 0)
+                    AddWheelDriver(ob, empty)
+                problem("untargeted FLWheel driver", retarget if empty is not None else None)
+
+    return report
+
+
+def ValidateFile(repair=False, ground_name=None):
+    """Validate the car rigs of the opened .blend file and print the report for the batch process"""
+    ground = bpy.data.objects.get(ground_name) if ground_name else None
+    rigs = [ValidateRig(ob, repair, ground) for ob in bpy.data.objects if ob.type == 'ARMATURE' and "metaCarRig" in ob]
+    if any(rig["repaired"] for rig in rigs):
+        bpy.ops.wm.save_mainfile()
+    print(REPORT_PREFIX + json.dumps({"file": bpy.data.filepath, "rigs": rigs}))
+
+
+def ValidateLibrary(directory, report_path, repair=False, ground_name=None, jobs=None):
+    """Validate all the .blend files of a directory, each one in its own background Blender process"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.endswith(".blend"))
+    paths.sort()
+
+    options = ["--validate-file"]
+    if repair:
+        options.append("--repair")
+    if ground_name:
+        options.extend(["--ground", ground_name])
+
+    def validate(path):
+        # a Python exception in the worker exits with code 1 instead of 0
+        command = [bpy.app.binary_path, "--background", "--factory-startup", path, "--python-exit-code", "1",
+                   "--python", __file__, "--"] + options
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        lines = result.stdout.splitlines()
+        for line in lines:
+            if line.startswith(REPORT_PREFIX):
+                return json.loads(line[len(REPORT_PREFIX):])
+        error = "Blender exited with code %d" % result.returncode
+        return {"file": path, "error": "\n".join([error] + lines[-WORKER_OUTPUT_LINES:])}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        reports = list(executor.map(validate, paths))
+
+    with open(report_path, "w") as report_file:
+        json.dump(reports, report_file, indent=2)
+    print("%d files validated, report written to %s" % (len(reports), report_path))
+
+
+def main(args):
+    """Command line entry point:
+
+    blender --background --python car_rig.py -- --validate DIRECTORY [--report FILE] [--repair] [--ground OBJECT] [--jobs N]
+    """
+    parser = argparse.ArgumentParser(prog="car_rig.py", description="Validate and repair car rigs of .blend files")
+    parser.add_argument("--validate", metavar="DIRECTORY", help="directory of .blend files to validate")
+    parser.add_argument("--validate-file", action="store_true", help="validate the opened .blend file (worker process)")
+    parser.add_argument("--report", default="car_rig_report.json", help="JSON report file")
+    parser.add_argument("--repair", action="store_true", help="repair the fixable problems and save the files")
+    parser.add_argument("--ground", help="name of the ground object for untargeted Shrinkwrap sensors")
+    parser.add_argument("--jobs", type=int, help="number of Blender processes (default: number of cores)")
+    args = parser.parse_args(args)
+    if args.validate_file:
+        ValidateFile(args.repair, args.ground)
+    elif args.validate is None:
+        parser.error("--validate DIRECTORY is required")
+    else:
+        ValidateLibrary(args.validate, args.report, args.repair, args.ground, args.jobs)
+
+
 #generate button
 class UImetaRigGenerate(bpy.types.Panel):
     bl_label = "Car Rig"
@@ -491,7 +1110,7 @@ class UIPanel(bpy.types.Panel):
     bl_region_type = "UI"
 
     @classmethod
-    def poll(cls, context):
+    def poll(cls, context):
         return context.object is not None and "metaCarRig" in context.object
 
     def draw(self, context):
@@ -500,6 +1119,10 @@ class UIPanel(bpy.types.Panel):
                 driver = context.object.animation_data.drivers.find('pose.bones["FLWheel"].rotation_euler')
                 if driver is not None:
                     self.layout.prop(driver.modifiers[0], 'coefficients', text = "size of wheel")
+        if context.object.parent is not None:
+            self.layout.operator("car.bake_ground_contact")
+            self.layout.operator("car.import_telemetry")
+            self.layout.operator("car.bake_wheel_spin")
 
 
 ### Add menu create car meta rig
@@ -528,6 +1151,67 @@ class GenerateRig(bpy.types.Operator):
         Generate((0,0,0))
         return {"FINISHED"}
 
+
+class BakeGroundContactOperator(bpy.types.Operator):
+    """Bake the ground contact of the wheel sensors on their Shrinkwrap target using a cached height field"""
+    bl_idname = "car.bake_ground_contact"
+    bl_label = "Bake ground contact"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    step = FloatProperty(name="Grid step", description="Spacing of the terrain height samples", default=0.5, min=0.01, unit='LENGTH')
+
+    @classmethod
+    def poll(cls, context):
+        return context.object is not None and "metaCarRig" in context.object and context.object.parent is not None
+
+    def execute(self, context):
+        scene = context.scene
+        frames = np.arange(scene.frame_start, scene.frame_end + 1, dtype=float)
+        if not BakeGroundContact(context.object, frames, self.step):
+            self.report({'ERROR'}, "The Shrinkwrap constraint of FLSensor must target the ground mesh")
+            return {'CANCELLED'}
+        return {'FINISHED'}
+
+
+class BakeWheelSpinOperator(bpy.types.Operator):
+    """Replace the wheel spin driver with precomputed spin curves over the scene frame range"""
+    bl_idname = "car.bake_wheel_spin"
+    bl_label = "Bake wheel spin"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.object is not None and "metaCarRig" in context.object and context.object.parent is not None
+
+    def execute(self, context):
+        scene = context.scene
+        BakeWheelSpin(context.object, np.arange(scene.frame_start, scene.frame_end + 1, dtype=float))
+        return {'FINISHED'}
+
+
+class ImportTelemetryOperator(bpy.types.Operator, ImportHelper):
+    """Key the car driver, steering and dampers from a telemetry CSV file (time, latitude, longitude, heading, speed)"""
+    bl_idname = "car.import_telemetry"
+    bl_label = "Import telemetry"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filename_ext = ".csv"
+    filter_glob = StringProperty(default="*.csv", options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return context.object is not None and "metaCarRig" in context.object and context.object.parent is not None
+
+    def execute(self, context):
+        try:
+            nb_frames = ImportTelemetry(context.object, self.filepath)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        self.report({'INFO'}, "%d frames imported" % nb_frames)
+        return {'FINISHED'}
+
+
 # Add to menu
 def menu_func(self, context):
     self.layout.operator("car.meta_rig",text="Car(Meta-Rig)",icon='MESH_CUBE')
@@ -538,6 +1222,9 @@ def register():
     bpy.utils.register_class(GenerateRig)
     bpy.utils.register_class(AddCarMetaRig)
     bpy.utils.register_class(UIPanel)
+    bpy.utils.register_class(BakeGroundContactOperator)
+    bpy.utils.register_class(ImportTelemetryOperator)
+    bpy.utils.register_class(BakeWheelSpinOperator)
 
 def unregister():
     bpy.types.INFO_MT_armature_add.remove(menu_func)
@@ -545,6 +1232,12 @@ def unregister():
     bpy.utils.unregister_class(GenerateRig)
     bpy.utils.unregister_class(AddCarMetaRig)
     bpy.utils.unregister_class(UIPanel)
+    bpy.utils.unregister_class(BakeGroundContactOperator)
+    bpy.utils.unregister_class(ImportTelemetryOperator)
+    bpy.utils.unregister_class(BakeWheelSpinOperator)
 
 if __name__ == "__main__":
-    register()
+    if "--" in sys.argv:
+        main(sys.argv[sys.argv.index("--") + 1:])
+    else:
+        register()
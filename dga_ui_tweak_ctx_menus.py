@@ -16,7 +16,6 @@ class KeymapsAddon():
     """Utility class to manage keymaps bindings"""
 
     created_keymaps = []
-    keyconfig = bpy.context.window_manager.keyconfigs.addon
 
     keymaps_name = {
         'PROPERTIES': ('Property Editor', 'PROPERTIES'),
@@ -37,17 +36,23 @@ class KeymapsAddon():
         'WINDOW': ('Window', 'EMPTY'),
     }
 
+    @classmethod
+    def keyconfig(cls):
+        # Resolved on demand so the module can be imported without a window manager
+        return bpy.context.window_manager.keyconfigs.addon
+
     @classmethod
     def is_available(cls):
-        return cls.keyconfig != None
+        return cls.keyconfig() != None
 
     @classmethod
     def new(cls, keymap_name, *args, **kargs):
         keymap = cls.keymaps_name[keymap_name]
         if cls.is_available():
-            km = cls.keyconfig.keymaps.find(name=keymap[0], space_type=keymap[1])
+            keyconfig = cls.keyconfig()
+            km = keyconfig.keymaps.find(name=keymap[0], space_type=keymap[1])
             if not km:
-                km = cls.keyconfig.keymaps.new(name=keymap[0], space_type=keymap[1])
+                km = keyconfig.keymaps.new(name=keymap[0], space_type=keymap[1])
             kmi = km.keymap_items.new(*args, **kargs)
             cls.created_keymaps.append((km, kmi))
             return kmi
@@ -89,13 +94,16 @@ class ArmaturePositionTogglerOperator(bpy.types.Operator):
         pass
 
     def execute(self, context):
-        armatures = []
-        for obj in bpy.context.selected_objects:
-            while obj is not None and obj.type != 'ARMATURE':
+        armatures = set()
+        # objects whose parent chain has already been walked
+        visited = set()
+        for obj in context.selected_objects:
+            while obj is not None and obj not in visited and obj.type != 'ARMATURE':
+                visited.add(obj)
                 obj = obj.parent
-            if obj is not None and obj not in armatures:
+            if obj is not None and obj.type == 'ARMATURE' and obj not in armatures:
                 obj.data.pose_position = 'POSE' if obj.data.pose_position == 'REST' else 'REST'
-                armatures.append(obj)
+                armatures.add(obj)
         return {'FINISHED'}
 
 
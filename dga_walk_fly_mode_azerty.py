@@ -1,52 +1,386 @@
 bl_info = {
     "name": "Walk/Fly mode support for azerty keyboard layout",
-    "location": "shift+F and ZQSD (instead of WASD)",
+    "description": "Remaps the WASD-style keys of the Walk and Fly modal keymaps for non-QWERTY keyboard layouts (AZERTY, QWERTZ, Dvorak). Records walk/fly navigation as camera keyframes.",
+    "location": "shift+F and ZQSD (instead of WASD), SHIFT+CTRL+F to start/stop navigation recording",
     "category": "User Interface",
     "author": "David Gayerie",
-    "version": (1, 0),
+    "version": (1, 2),
     "blender": (2, 78, 0),
     "wiki_url": "https://github.com/spoonless/blender-addons",
     "tracker_url": "https://github.com/spoonless/blender-addons/issues",
 }
 
 import bpy
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+# Modal keymaps using physical key positions (WASD-style navigation)
+MODAL_KEYMAPS = ('View3D Fly Modal', 'View3D Walk Modal')
+
+# For each layout, the key found on the keyboard at the position of a QWERTY key.
+# Keys not listed are at the same position as on a QWERTY keyboard.
+LAYOUTS = {
+    'AZERTY': {
+        'A': 'Q', 'Q': 'A', 'W': 'Z', 'Z': 'W',
+    },
+    'QWERTZ': {
+        'Y': 'Z', 'Z': 'Y',
+    },
+    'DVORAK': {
+        'Q': 'QUOTE', 'W': 'COMMA', 'E': 'PERIOD', 'R': 'P', 'T': 'Y', 'Y': 'F',
+        'U': 'G', 'I': 'C', 'O': 'R', 'P': 'L',
+        'S': 'O', 'D': 'E', 'F': 'U', 'G': 'I', 'H': 'D', 'J': 'H', 'K': 'T', 'L': 'N',
+        'Z': 'SEMI_COLON', 'X': 'Q', 'C': 'J', 'V': 'K', 'B': 'X', 'N': 'B',
+    },
+}
+
+# Letter keys of the default QWERTY modal keymaps, used when the default keyconfig is not
+# filled yet (at startup, addons are registered before the default keymaps are created)
+QWERTY_MODAL_ITEMS = [
+    ('View3D Fly Modal', propvalue, key, 'PRESS', {'any': False, 'shift': False, 'ctrl': False, 'alt': False, 'oskey': False})
+    for propvalue, key in (
+        ('FORWARD', 'W'), ('BACKWARD', 'S'), ('LEFT', 'A'), ('RIGHT', 'D'), ('UP', 'E'), ('DOWN', 'Q'),
+        ('UP', 'R'), ('DOWN', 'F'), ('AXIS_LOCK_X', 'X'), ('AXIS_LOCK_Z', 'Z'),
+    )
+] + [
+    ('View3D Walk Modal', propvalue + suffix, key, value, {'any': True})
+    for suffix, value in (('', 'PRESS'), ('_STOP', 'RELEASE'))
+    for propvalue, key in (
+        ('FORWARD', 'W'), ('BACKWARD', 'S'), ('LEFT', 'A'), ('RIGHT', 'D'), ('UP', 'E'), ('DOWN', 'Q'),
+    )
+]
+
+# File caching the translation tables, by blender and addon versions, layout and key translation
+TRANSLATION_CACHE = "walk_fly_layouts.json"
 
 keymaps = []
+recorder_keymaps = []
 
-def register():
+# Navigation samples kept by the recorder: 10 minutes at 120 Hz
+RECORDER_CAPACITY = 120 * 60 * 10
+
+
+def default_modal_items():
+    """Return the active items of the default modal keymaps as tuples (keymap name, propvalue, key type, value, modifiers)."""
+    items = []
+    default_kc = bpy.context.window_manager.keyconfigs.default
+    for keymap_name in MODAL_KEYMAPS:
+        km = default_kc.keymaps.get(keymap_name)
+        if km is None:
+            continue
+        for kmi in km.keymap_items:
+            if not kmi.active:
+                continue
+            modifiers = {'any': kmi.any}
+            if not kmi.any:
+                modifiers.update(shift=kmi.shift, ctrl=kmi.ctrl, alt=kmi.alt, oskey=kmi.oskey)
+            items.append((keymap_name, kmi.propvalue, kmi.type, kmi.value, modifiers))
+    return items
+
+
+def build_translation_table(layout, items):
+    """Return the items whose key is at another position for the given layout, with the translated key."""
+    translation = LAYOUTS[layout]
+    return [(keymap_name, propvalue, translation[key], value, modifiers)
+            for keymap_name, propvalue, key, value, modifiers in items if key in translation]
+
+
+def translation_cache_path():
+    return os.path.join(bpy.utils.user_resource('CONFIG', autocreate=True), TRANSLATION_CACHE)
+
+
+def load_translation_tables():
+    try:
+        with open(translation_cache_path()) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def translation_cache_key(layout):
+    """Key of a cached table: blender and addon versions, layout name and hash of its key translation"""
+    translation = json.dumps(sorted(LAYOUTS[layout].items())).encode()
+    return "%s/%s/%s/%s" % (".".join(str(n) for n in bpy.app.version), ".".join(str(n) for n in bl_info["version"]),
+                            layout, hashlib.sha1(translation).hexdigest()[:12])
+
+
+def get_translation_table(layout):
+    """Return the remapped items for the given layout.
+
+    The table is cached on disk by blender and addon versions, layout and key translation,
+    so the default keyconfig is only scanned once. When the default modal keymaps are not
+    created yet, the table is built from the QWERTY letter keys and not cached. This is
+    always the case when the addons are registered at startup: the cache is only written
+    when the addon is enabled or its layout changed during a session.
+    """
+    key = translation_cache_key(layout)
+    tables = load_translation_tables()
+    table = tables.get(key)
+    if table is not None:
+        return [tuple(item) for item in table]
+
+    items = default_modal_items()
+    if not items:
+        return build_translation_table(layout, QWERTY_MODAL_ITEMS)
+
+    table = build_translation_table(layout, items)
+    # drop the tables of the other blender and addon versions
+    prefix = key.rsplit("/", 2)[0] + "/"
+    tables = dict((other, other_table) for other, other_table in tables.items() if other.startswith(prefix))
+    tables[key] = table
+    try:
+        with open(translation_cache_path(), "w") as cache_file:
+            json.dump(tables, cache_file)
+    except OSError:
+        pass
+    return table
+
+
+def register_keymaps(layout):
     kc = bpy.context.window_manager.keyconfigs.addon
     if kc:
-        km = kc.keymaps.new('View3D Fly Modal', space_type='EMPTY', region_type='WINDOW', modal=True)
-        kmis = km.keymap_items
-
-        keymaps.append((km, kmis.new_modal('FORWARD', 'Z', 'PRESS')))
-        keymaps.append((km, kmis.new_modal('BACKWARD', 'S', 'PRESS')))
-        keymaps.append((km, kmis.new_modal('LEFT', 'Q', 'PRESS')))
-        keymaps.append((km, kmis.new_modal('RIGHT', 'D', 'PRESS')))
-        keymaps.append((km, kmis.new_modal('UP', 'E', 'PRESS')))
-        keymaps.append((km, kmis.new_modal('DOWN', 'A', 'PRESS')))
-        keymaps.append((km, kmis.new_modal('UP', 'R', 'PRESS')))
-        keymaps.append((km, kmis.new_modal('DOWN', 'F', 'PRESS')))
-        keymaps.append((km, kmis.new_modal('AXIS_LOCK_X', 'X', 'PRESS')))
-        keymaps.append((km, kmis.new_modal('AXIS_LOCK_Z', 'W', 'PRESS')))
-
-        km = kc.keymaps.new('View3D Walk Modal', space_type='EMPTY', region_type='WINDOW', modal=True)
-        kmis = km.keymap_items
-
-        keymaps.append((km, kmis.new_modal('FORWARD', 'Z', 'PRESS', any=True)))
-        keymaps.append((km, kmis.new_modal('BACKWARD', 'S', 'PRESS', any=True)))
-        keymaps.append((km, kmis.new_modal('LEFT', 'Q', 'PRESS', any=True)))
-        keymaps.append((km, kmis.new_modal('RIGHT', 'D', 'PRESS', any=True)))
-        keymaps.append((km, kmis.new_modal('UP', 'E', 'PRESS', any=True)))
-        keymaps.append((km, kmis.new_modal('DOWN', 'A', 'PRESS', any=True)))
-        keymaps.append((km, kmis.new_modal('FORWARD_STOP', 'Z', 'RELEASE', any=True)))
-        keymaps.append((km, kmis.new_modal('BACKWARD_STOP', 'S', 'RELEASE', any=True)))
-        keymaps.append((km, kmis.new_modal('LEFT_STOP', 'Q', 'RELEASE', any=True)))
-        keymaps.append((km, kmis.new_modal('RIGHT_STOP', 'D', 'RELEASE', any=True)))
-        keymaps.append((km, kmis.new_modal('UP_STOP', 'E', 'RELEASE', any=True)))
-        keymaps.append((km, kmis.new_modal('DOWN_STOP', 'A', 'RELEASE', any=True)))
+        table = get_translation_table(layout)
+        keymaps_by_name = {}
+        for keymap_name, propvalue, key, value, modifiers in table:
+            km = keymaps_by_name.get(keymap_name)
+            if km is None:
+                km = keymaps_by_name[keymap_name] = kc.keymaps.new(keymap_name, space_type='EMPTY', region_type='WINDOW', modal=True)
+            keymaps.append((km, km.keymap_items.new_modal(propvalue, key, value, **modifiers)))
 
-def unregister():
+
+def unregister_keymaps():
     for km, kmi in keymaps:
         km.keymap_items.remove(kmi)
     keymaps.clear()
+
+
+def update_layout(self, context):
+    unregister_keymaps()
+    register_keymaps(self.layout_name)
+
+
+def camera_euler(matrices):
+    """Return the XYZ euler rotations (n, 3) of an array of 4x4 matrices (n, 4, 4)."""
+    r = matrices[:, :3, :3]
+    cy = np.hypot(r[:, 0, 0], r[:, 1, 0])
+    euler = np.empty((len(matrices), 3))
+    euler[:, 0] = np.arctan2(r[:, 2, 1], r[:, 2, 2])
+    euler[:, 1] = np.arctan2(-r[:, 2, 0], cy)
+    euler[:, 2] = np.arctan2(r[:, 1, 0], r[:, 0, 0])
+    # avoid 2*pi flips between consecutive samples
+    return np.unwrap(euler, axis=0)
+
+
+def simplify(x, y, tolerance):
+    """Ramer-Douglas-Peucker simplification of the curve (x, y), return the indices of the kept points.
+
+    The error is measured along y, as a keyframed curve is evaluated for each x.
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    keep[0] = keep[-1] = True
+    segments = [(0, len(x) - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        span = (x[last] - x[first]) or 1.0
+        t = (x[first + 1:last] - x[first]) / span
+        error = np.abs(y[first + 1:last] - y[first] - t * (y[last] - y[first]))
+        i = np.argmax(error)
+        if error[i] > tolerance:
+            i += first + 1
+            keep[i] = True
+            segments.append((first, i))
+            segments.append((i, last))
+    return np.flatnonzero(keep)
+
+
+def remove_fcurve(action, data_path, index):
+    for fcurve in action.fcurves:
+        if fcurve.data_path == data_path and fcurve.array_index == index:
+            action.fcurves.remove(fcurve)
+            break
+
+
+def write_keyframes(action, data_path, index, frames, values, group):
+    """Replace the fcurve data_path[index] of the action with linear keyframes."""
+    remove_fcurve(action, data_path, index)
+    fcurve = action.fcurves.new(data_path, index, group)
+    fcurve.keyframe_points.add(len(frames))
+    co = np.empty(2 * len(frames))
+    co[0::2] = frames
+    co[1::2] = values
+    fcurve.keyframe_points.foreach_set('co', co)
+    for keyframe in fcurve.keyframe_points:
+        keyframe.interpolation = 'LINEAR'
+    fcurve.update()
+
+
+class NavigationRecorder():
+    """Record the view matrix of a 3D view in a ring buffer each time it is redrawn"""
+
+    def __init__(self, region_data, capacity=RECORDER_CAPACITY):
+        self.region_data = region_data.as_pointer()
+        # time followed by the 16 values of the camera matrix
+        self.samples = np.empty((capacity, 17))
+        self.count = 0
+        self.handle = bpy.types.SpaceView3D.draw_handler_add(self.sample, (), 'WINDOW', 'POST_VIEW')
+
+    def sample(self):
+        rv3d = bpy.context.region_data
+        if rv3d is None or rv3d.as_pointer() != self.region_data:
+            return
+        row = self.samples[self.count % len(self.samples)]
+        row[0] = time.perf_counter()
+        row[1:] = np.array(rv3d.view_matrix.inverted()).ravel()
+        self.count += 1
+
+    def stop(self):
+        bpy.types.SpaceView3D.draw_handler_remove(self.handle, 'WINDOW')
+        start = self.count % len(self.samples)
+        if self.count <= len(self.samples):
+            return self.samples[:self.count]
+        return np.concatenate((self.samples[start:], self.samples[:start]))
+
+
+class NavigationRecorderOperator(bpy.types.Operator):
+    """Start/stop recording the view navigation (walk or fly mode), then bake it on the scene camera"""
+    bl_idname = "view3d.toggle_navigation_recording"
+    bl_label = "[DGA] Toggle navigation recording"
+
+    recorder = None
+
+    @classmethod
+    def poll(cls, context):
+        return cls.recorder is not None or context.region_data is not None
+
+    def execute(self, context):
+        cls = self.__class__
+        if cls.recorder is None:
+            cls.recorder = NavigationRecorder(context.region_data)
+            self.report({'INFO'}, "Navigation recording started")
+            return {'FINISHED'}
+
+        samples = cls.recorder.stop()
+        cls.recorder = None
+        if len(samples) == 0:
+            self.report({'WARNING'}, "No navigation recorded")
+            return {'CANCELLED'}
+
+        # the samples are kept by the bake operator, which can be redone with other tolerances
+        BakeNavigationOperator.samples = samples.copy()
+        bpy.ops.view3d.bake_navigation()
+        return {'FINISHED'}
+
+
+class BakeNavigationOperator(bpy.types.Operator):
+    """Bake the last recorded view navigation on the scene camera"""
+    bl_idname = "view3d.bake_navigation"
+    bl_label = "[DGA] Bake navigation"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    samples = None
+
+    location_tolerance = bpy.props.FloatProperty(
+        name="Location tolerance",
+        description="Maximum location error of the baked camera path",
+        default=0.01, min=0.0, unit='LENGTH',
+    )
+    rotation_tolerance = bpy.props.FloatProperty(
+        name="Rotation tolerance",
+        description="Maximum rotation error of the baked camera path",
+        default=0.005, min=0.0, unit='ROTATION',
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return cls.samples is not None
+
+    def execute(self, context):
+        camera = context.scene.camera
+        if camera is None:
+            self.report({'ERROR'}, "No scene camera to bake the navigation on")
+            return {'CANCELLED'}
+
+        self.bake(context.scene, camera, self.__class__.samples)
+        return {'FINISHED'}
+
+    def bake(self, scene, camera, samples):
+        fps = scene.render.fps / scene.render.fps_base
+        frames = scene.frame_current + (samples[:, 0] - samples[0, 0]) * fps
+        matrices = samples[:, 1:].reshape(-1, 4, 4)
+        if camera.parent is not None:
+            parent_matrix = camera.parent.matrix_world * camera.matrix_parent_inverse
+            matrices = np.matmul(np.array(parent_matrix.inverted()), matrices)
+
+        if camera.animation_data is None:
+            camera.animation_data_create()
+        if camera.animation_data.action is None:
+            camera.animation_data.action = bpy.data.actions.new(camera.name + "Action")
+        action = camera.animation_data.action
+        camera.rotation_mode = 'XYZ'
+
+        nb_keys = 0
+        channels = (
+            ('location', matrices[:, :3, 3], self.location_tolerance),
+            ('rotation_euler', camera_euler(matrices), self.rotation_tolerance),
+        )
+        for data_path, values, tolerance in channels:
+            for index in range(3):
+                kept = simplify(frames, values[:, index], tolerance)
+                write_keyframes(action, data_path, index, frames[kept], values[kept, index], "Object Transforms")
+                nb_keys += len(kept)
+
+        self.report({'INFO'}, "Navigation baked: %d samples, %d keyframes" % (len(samples), nb_keys))
+
+
+def register_recorder_keymaps():
+    kc = bpy.context.window_manager.keyconfigs.addon
+    if kc:
+        km = kc.keymaps.new('3D View', space_type='VIEW_3D')
+        recorder_keymaps.append((km, km.keymap_items.new(NavigationRecorderOperator.bl_idname, 'F', 'PRESS', shift=True, ctrl=True)))
+
+
+def unregister_recorder_keymaps():
+    for km, kmi in recorder_keymaps:
+        km.keymap_items.remove(kmi)
+    recorder_keymaps.clear()
+
+
+class WalkFlyLayoutPreferences(bpy.types.AddonPreferences):
+    bl_idname = __name__
+
+    layout_name = bpy.props.EnumProperty(
+        name="Keyboard layout",
+        description="Keyboard layout used to remap Walk and Fly navigation keys",
+        items=[(name, name.capitalize(), "") for name in sorted(LAYOUTS)],
+        default='AZERTY',
+        update=update_layout,
+    )
+
+    def draw(self, context):
+        self.layout.prop(self, "layout_name")
+
+
+def register():
+    bpy.utils.register_class(WalkFlyLayoutPreferences)
+    preferences = bpy.context.user_preferences.addons[__name__].preferences
+    register_keymaps(preferences.layout_name)
+    bpy.utils.register_class(NavigationRecorderOperator)
+    bpy.utils.register_class(BakeNavigationOperator)
+    register_recorder_keymaps()
+
+
+def unregister():
+    if NavigationRecorderOperator.recorder is not None:
+        NavigationRecorderOperator.recorder.stop()
+        NavigationRecorderOperator.recorder = None
+    BakeNavigationOperator.samples = None
+    unregister_recorder_keymaps()
+    bpy.utils.unregister_class(BakeNavigationOperator)
+    bpy.utils.unregister_class(NavigationRecorderOperator)
+    unregister_keymaps()
+    bpy.utils.unregister_class(WalkFlyLayoutPreferences)
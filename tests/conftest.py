@@ -0,0 +1,40 @@
+import importlib
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import fake_bpy
+
+fake_bpy.install()
+
+
+def import_addon(name):
+    """Import an addon module from scratch"""
+    sys.modules.pop(name, None)
+    return importlib.import_module(name)
+
+
+def best_time(func, repeat=20):
+    """Micro-benchmark: best wall time of func() in seconds"""
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@pytest.fixture
+def bpy(tmp_path):
+    fake_bpy.reset(str(tmp_path))
+    return fake_bpy.bpy
+
+
+@pytest.fixture
+def rna():
+    return fake_bpy.rna
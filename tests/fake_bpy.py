@@ -0,0 +1,736 @@
+"""Pure-Python stand-in for the parts of the Blender API used by the addons.
+
+``install()`` registers fake ``bpy``, ``bpy_extras`` and ``mathutils`` modules in
+``sys.modules`` so the addons can be imported outside Blender, ``reset()`` gives a
+fresh context and data. Every attribute or item written on a fake RNA struct is
+counted in ``rna.writes``, every collection ``new``/``remove``, operator and
+registration call in ``rna.calls``.
+"""
+
+import sys
+import tempfile
+import types
+
+
+class RNACounter():
+    """Count of the RNA writes and calls made since the last reset"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.writes = 0
+        self.calls = 0
+
+
+rna = RNACounter()
+
+
+#####################################mathutils#################################
+class Vector():
+    def __init__(self, values=(0.0, 0.0, 0.0)):
+        self._values = [float(v) for v in values]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+    def __setitem__(self, index, value):
+        self._values[index] = float(value)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __add__(self, other):
+        return Vector(a + b for a, b in zip(self, other))
+
+    def __sub__(self, other):
+        return Vector(a - b for a, b in zip(self, other))
+
+    def __mul__(self, scalar):
+        return Vector(a * scalar for a in self)
+
+    def __truediv__(self, scalar):
+        return Vector(a / scalar for a in self)
+
+    def __repr__(self):
+        return "Vector(%r)" % (tuple(self._values),)
+
+    def copy(self):
+        return Vector(self)
+
+    x = property(lambda self: self[0], lambda self, v: self.__setitem__(0, v))
+    y = property(lambda self: self[1], lambda self, v: self.__setitem__(1, v))
+    z = property(lambda self: self[2], lambda self, v: self.__setitem__(2, v))
+
+
+class Matrix():
+    def __init__(self, rows=None):
+        self._rows = [list(map(float, row)) for row in rows] if rows is not None else []
+        if rows is None:
+            self.identity()
+
+    def identity(self):
+        self._rows = [[float(i == j) for j in range(4)] for i in range(4)]
+
+    def is_identity(self):
+        return self._rows == Matrix()._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter([list(row) for row in self._rows])
+
+    def __getitem__(self, index):
+        return self._rows[index]
+
+    def copy(self):
+        return Matrix(self._rows)
+
+    def to_3x3(self):
+        return Matrix([row[:3] for row in self._rows[:3]])
+
+    def inverted(self):
+        import numpy
+        return Matrix(numpy.linalg.inv(numpy.array(self._rows)))
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix):
+            return Matrix([[sum(a * b for a, b in zip(row, col)) for col in zip(*other._rows)] for row in self._rows])
+        if len(other) == len(self._rows) - 1:
+            # 3D vector with an homogeneous 4x4 matrix
+            return Vector(sum(a * b for a, b in zip(row, list(other) + [1.0])) for row in self._rows[:-1])
+        return Vector(sum(a * b for a, b in zip(row, other)) for row in self._rows)
+
+
+class RNAArray(Vector):
+    """Array property of a fake RNA struct, item writes are counted"""
+
+    def __init__(self, values, item_type=float):
+        self._item_type = item_type
+        self._values = [item_type(v) for v in values]
+
+    def __setitem__(self, index, value):
+        rna.writes += 1
+        self._values[index] = self._item_type(value)
+
+    def copy(self):
+        return Vector(self)
+
+
+#####################################RNA structs#################################
+class Struct():
+    """Fake RNA struct accepting any property, writes are counted"""
+
+    # properties stored as RNAArray
+    _arrays = ()
+
+    def __init__(self, **props):
+        object.__setattr__(self, '_idprops', {})
+        for name, value in props.items():
+            self._set(name, value)
+
+    def _set(self, name, value):
+        if name in self._arrays:
+            value = RNAArray(value)
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        rna.writes += 1
+        self._set(name, value)
+
+    # ID properties
+    def __getitem__(self, key):
+        return self._idprops[key]
+
+    def __setitem__(self, key, value):
+        rna.writes += 1
+        self._idprops[key] = value
+
+    def __contains__(self, key):
+        return key in self._idprops
+
+    def get(self, key, default=None):
+        return self._idprops.get(key, default)
+
+    def as_pointer(self):
+        return id(self)
+
+
+class Collection():
+    """Fake RNA collection, items are looked up by index or name"""
+
+    def __init__(self, factory=None):
+        self._items = []
+        self._factory = factory
+        self.is_updated = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._items[key]
+        item = self.get(key)
+        if item is None:
+            raise KeyError(key)
+        return item
+
+    def __contains__(self, key):
+        if isinstance(key, str):
+            return self.get(key) is not None
+        return any(item is key for item in self._items)
+
+    def get(self, name, default=None):
+        for item in self._items:
+            if getattr(item, 'name', None) == name:
+                return item
+        return default
+
+    def keys(self):
+        return [item.name for item in self._items]
+
+    def values(self):
+        return list(self._items)
+
+    def items(self):
+        return [(item.name, item) for item in self._items]
+
+    def foreach_get(self, attr, seq):
+        rna.calls += 1
+        values = []
+        for item in self._items:
+            value = getattr(item, attr)
+            if isinstance(value, Vector):
+                values.extend(value)
+            else:
+                values.append(value)
+        for i, value in enumerate(values):
+            seq[i] = value
+
+    def _append(self, item):
+        self._items.append(item)
+        return item
+
+    def new(self, *args, **kwargs):
+        rna.calls += 1
+        return self._append(self._factory(*args, **kwargs))
+
+    def remove(self, item):
+        rna.calls += 1
+        for i, existing in enumerate(self._items):
+            if existing is item:
+                del self._items[i]
+                return
+        raise ValueError("%r not in collection" % (item,))
+
+
+#####################################Keymaps#################################
+class KeyMapItem(Struct):
+    def __init__(self, idname='', type='NONE', value='PRESS', any=False, shift=False, ctrl=False, alt=False,
+                 oskey=False, key_modifier='NONE', propvalue=''):
+        Struct.__init__(self, idname=idname, type=type, value=value, any=any, shift=shift, ctrl=ctrl, alt=alt,
+                        oskey=oskey, key_modifier=key_modifier, propvalue=propvalue, active=True,
+                        properties=Struct())
+
+
+class KeyMapItems(Collection):
+    def __init__(self):
+        Collection.__init__(self, KeyMapItem)
+
+    def new_modal(self, propvalue, type, value, **kwargs):
+        rna.calls += 1
+        return self._append(KeyMapItem(type=type, value=value, propvalue=propvalue, **kwargs))
+
+
+class KeyMap(Struct):
+    def __init__(self, name, space_type='EMPTY', region_type='WINDOW', modal=False):
+        Struct.__init__(self, name=name, space_type=space_type, region_type=region_type, is_modal=modal,
+                        keymap_items=KeyMapItems())
+
+
+class KeyMaps(Collection):
+    def __init__(self):
+        Collection.__init__(self, KeyMap)
+
+    def find(self, name, space_type='EMPTY', region_type='WINDOW'):
+        for km in self._items:
+            if km.name == name and km.space_type == space_type and km.region_type == region_type:
+                return km
+        return None
+
+    def new(self, name, space_type='EMPTY', region_type='WINDOW', modal=False):
+        rna.calls += 1
+        km = self.find(name, space_type, region_type)
+        if km is None:
+            km = self._append(KeyMap(name, space_type, region_type, modal))
+        return km
+
+
+class KeyConfig(Struct):
+    def __init__(self, name):
+        Struct.__init__(self, name=name, keymaps=KeyMaps())
+
+
+#####################################Animation#################################
+class DriverVariable(Struct):
+    def __init__(self):
+        Struct.__init__(self, name='var', type='SINGLE_PROP', targets=[Struct(id=None)])
+
+
+class FCurve(Struct):
+    def __init__(self, data_path, array_index=0, driver=False):
+        Struct.__init__(self, data_path=data_path, array_index=array_index)
+        if driver:
+            self._set('driver', Struct(type='SCRIPTED', variables=Collection(DriverVariable)))
+            self._set('modifiers', [Struct(type='GENERATOR', mode='POLYNOMIAL', poly_order=1, coefficients=(0, 1))])
+
+
+class Keyframe(Struct):
+    def __init__(self):
+        Struct.__init__(self, co=Vector((0.0, 0.0)), interpolation='BEZIER')
+
+
+class KeyframePoints(Collection):
+    """Keyframes of an action fcurve"""
+
+    # foreach_set only handles bool, int and float properties
+    FOREACH_TYPES = {'co': float, 'select_control_point': bool}
+
+    def __init__(self):
+        Collection.__init__(self, Keyframe)
+
+    def add(self, count):
+        rna.calls += 1
+        for i in range(count):
+            self._append(Keyframe())
+
+    def foreach_set(self, attr, seq):
+        rna.calls += 1
+        if attr not in self.FOREACH_TYPES:
+            raise TypeError("foreach_set(attr, sequence): '%s' is not a bool, int or float property" % attr)
+        values = [self.FOREACH_TYPES[attr](v) for v in seq]
+        size = len(getattr(self._items[0], attr)) if self._items and attr == 'co' else 1
+        if len(values) != size * len(self._items):
+            raise ValueError("foreach_set: wrong sequence length for %s" % attr)
+        for i, keyframe in enumerate(self._items):
+            value = Vector(values[i * size:(i + 1) * size]) if attr == 'co' else values[i]
+            object.__setattr__(keyframe, attr, value)
+
+
+class ActionFCurve(FCurve):
+    def __init__(self, data_path, index=0, action_group=''):
+        FCurve.__init__(self, data_path, index)
+        self._set('group', action_group)
+        self._set('keyframe_points', KeyframePoints())
+
+    def update(self):
+        rna.calls += 1
+
+    def evaluate(self, frame):
+        """Value at frame, the keyframes are evaluated as linear"""
+        import numpy
+        co = numpy.array([tuple(keyframe.co) for keyframe in self.keyframe_points])
+        return float(numpy.interp(frame, co[:, 0], co[:, 1]))
+
+
+class AnimDataDrivers(Collection):
+    def find(self, data_path, index=0):
+        for fcurve in self._items:
+            if fcurve.data_path == data_path and fcurve.array_index == index:
+                return fcurve
+        return None
+
+
+class AnimData(Struct):
+    def __init__(self):
+        Struct.__init__(self, action=None, drivers=AnimDataDrivers())
+
+
+#####################################Objects and armatures#################################
+class Bone(Struct):
+    def __init__(self, name, head_local=(0, 0, 0), tail_local=(0, 0, 1), parent=None):
+        Struct.__init__(self, name=name, head_local=Vector(head_local), tail_local=Vector(tail_local), parent=parent,
+                        matrix_local=Matrix())
+
+
+class EditBone(Struct):
+    _arrays = ('head', 'tail')
+
+    def __init__(self, name, head=(0, 0, 0), tail=(0, 1, 0)):
+        Struct.__init__(self, name=name, head=head, tail=tail, roll=0.0, parent=None)
+        self._set('layers', RNAArray([True] + [False] * 31, bool))
+
+
+class Constraint(Struct):
+    def __init__(self, type):
+        Struct.__init__(self, type=type, name=type.replace('_', ' ').title(), target=None, subtarget='', mute=False,
+                        influence=1.0)
+
+
+class Constraints(Collection):
+    def __init__(self):
+        Collection.__init__(self, Constraint)
+
+
+class PoseBone(Struct):
+    def __init__(self, ob, bone):
+        Struct.__init__(self, name=bone.name, id_data=ob, bone=bone, head=Vector(bone.head_local),
+                        constraints=Constraints(), rotation_mode='QUATERNION', lock_location=(False, False, False),
+                        lock_rotation=(False, False, False))
+
+    def driver_add(self, path, index=-1):
+        rna.calls += 1
+        ob = self.id_data
+        if ob.animation_data is None:
+            ob.animation_data_create()
+        data_path = 'pose.bones["%s"].%s' % (self.name, path)
+        return ob.animation_data.drivers._append(FCurve(data_path, index, driver=True))
+
+
+class Armature(Struct):
+    def __init__(self, name):
+        Struct.__init__(self, name=name, bones=Collection(), edit_bones=Collection(EditBone), pose_position='POSE')
+
+
+class Mesh(Struct):
+    """Fake mesh, ray casts hit the surface z = height(x, y) in local coordinates (no hit when height is None)"""
+
+    def __init__(self, name, height=None):
+        Struct.__init__(self, name=name, vertices=Collection(), height=height or (lambda x, y: 0.0))
+
+
+class Object(Struct):
+    def __init__(self, name, data=None):
+        if data is None:
+            type = 'EMPTY'
+        elif isinstance(data, Armature):
+            type = 'ARMATURE'
+        else:
+            type = 'MESH'
+        Struct.__init__(self, name=name, data=data, type=type, parent=None, mode='OBJECT', select=False,
+                        location=Vector(), rotation_euler=Vector(), scale=Vector((1, 1, 1)), rotation_mode='XYZ',
+                        animation_data=None, constraints=Constraints(), modifiers=Collection(),
+                        matrix_world=Matrix(), matrix_basis=Matrix(), matrix_parent_inverse=Matrix(),
+                        pose=Struct(bones=Collection()) if type == 'ARMATURE' else None)
+
+    @property
+    def bound_box(self):
+        coords = [tuple(vertex.co) for vertex in self.data.vertices] or [(0, 0, 0)]
+        low, high = [min(c) for c in zip(*coords)], [max(c) for c in zip(*coords)]
+        return [(x, y, z) for x in (low[0], high[0]) for y in (low[1], high[1]) for z in (low[2], high[2])]
+
+    def ray_cast(self, origin, direction):
+        """Cast a vertical ray on the mesh surface, in local coordinates"""
+        rna.calls += 1
+        z = self.data.height(origin[0], origin[1])
+        if z is None:
+            return False, Vector(), Vector(), -1
+        return True, Vector((origin[0], origin[1], z)), Vector((0, 0, 1)), 0
+
+    def animation_data_create(self):
+        rna.calls += 1
+        if self.animation_data is None:
+            self._set('animation_data', AnimData())
+        return self.animation_data
+
+    def driver_remove(self, path, index=-1):
+        rna.calls += 1
+        drivers = self.animation_data.drivers
+        for fcurve in drivers:
+            if fcurve.data_path == path and index in (-1, fcurve.array_index):
+                drivers._items.remove(fcurve)
+
+
+def sync_edit_bones(ob):
+    """Copy the edit bones back to the bones and pose bones, as when leaving edit mode"""
+    amt = ob.data
+    bones = Collection()
+    for eb in amt.edit_bones:
+        bones._append(Bone(eb.name, eb.head, eb.tail, eb.parent.name if eb.parent is not None else None))
+    amt._set('bones', bones)
+    previous = ob.pose.bones
+    pose_bones = Collection()
+    for bone in bones:
+        pose_bone = previous.get(bone.name)
+        if pose_bone is None:
+            pose_bone = PoseBone(ob, bone)
+        else:
+            pose_bone._set('bone', bone)
+            pose_bone._set('head', Vector(bone.head_local))
+        pose_bones._append(pose_bone)
+    ob.pose._set('bones', pose_bones)
+
+
+#####################################Scene and context#################################
+class SceneObjects(Collection):
+    def __init__(self):
+        Collection.__init__(self)
+        self.active = None
+
+    def link(self, ob):
+        rna.calls += 1
+        self._append(ob)
+
+
+class Scene(Struct):
+    def __init__(self):
+        Struct.__init__(self, name="Scene", objects=SceneObjects(), frame_start=1, frame_end=250, frame_current=1,
+                        camera=None, render=Struct(fps=24, fps_base=1.0, use_simplify=False),
+                        unit_settings=Struct(system='NONE', scale_length=1.0),
+                        tool_settings=Struct(proportional_edit='DISABLED', use_proportional_edit_objects=False,
+                                             use_proportional_edit_mask=False, proportional_edit_falloff='SMOOTH'))
+
+    def update(self):
+        rna.calls += 1
+
+
+class Context():
+    def __init__(self):
+        self.scene = Scene()
+        self.window_manager = Struct(keyconfigs=Struct(addon=KeyConfig("Blender Addon"),
+                                                       default=KeyConfig("Blender"),
+                                                       user=KeyConfig("Blender User")))
+        self.user_preferences = Struct(addons=Collection(), edit=Struct(keyframe_new_interpolation_type='BEZIER'))
+        self.space_data = Struct(type='VIEW_3D', clip=None, mode='TRACKING', pivot_point='MEDIAN_POINT')
+        self.mode = 'OBJECT'
+        self.region_data = None
+        self.area = Struct(type='VIEW_3D')
+
+    @property
+    def active_object(self):
+        return self.scene.objects.active
+
+    object = active_object
+
+    @property
+    def tool_settings(self):
+        return self.scene.tool_settings
+
+    @property
+    def selected_objects(self):
+        return [ob for ob in self.scene.objects if ob.select]
+
+
+#####################################bpy modules#################################
+class BlendData():
+    def __init__(self):
+        self.filepath = ""
+        self.objects = Collection(Object)
+        self.armatures = Collection(Armature)
+        self.meshes = Collection(Mesh)
+        self.actions = Collection(lambda name: Struct(name=name, fcurves=Collection(ActionFCurve)))
+        self.brushes = Collection(lambda name: Struct(name=name, use_paint_sculpt=False))
+
+
+def mode_set(mode='OBJECT'):
+    rna.calls += 1
+    ob = bpy.context.active_object
+    if ob.mode == 'EDIT' and mode != 'EDIT':
+        sync_edit_bones(ob)
+    elif mode == 'EDIT' and ob.mode != 'EDIT':
+        edit_bones = Collection(EditBone)
+        for bone in ob.data.bones:
+            eb = edit_bones._append(EditBone(bone.name, bone.head_local, bone.tail_local))
+            if bone.parent is not None:
+                eb._set('parent', edit_bones[bone.parent])
+        ob.data._set('edit_bones', edit_bones)
+    elif mode == 'POSE':
+        sync_pose(ob)
+    object.__setattr__(ob, 'mode', mode)
+    return {'FINISHED'}
+
+
+def sync_pose(ob):
+    for bone in ob.data.bones:
+        if bone.name not in ob.pose.bones:
+            ob.pose.bones._append(PoseBone(ob, bone))
+
+
+def object_add(type='EMPTY', location=(0, 0, 0)):
+    rna.calls += 1
+    ob = bpy.data.objects.new("Empty" if type == 'EMPTY' else type.title(), None)
+    ob._set('location', Vector(location))
+    bpy.context.scene.objects.link(ob)
+    bpy.context.scene.objects.active = ob
+    return {'FINISHED'}
+
+
+def select_all(action='TOGGLE'):
+    rna.calls += 1
+    objects = bpy.context.scene.objects
+    select = action == 'SELECT' or (action == 'TOGGLE' and not any(ob.select for ob in objects))
+    for ob in objects:
+        object.__setattr__(ob, 'select', select)
+    return {'FINISHED'}
+
+
+def register_class(cls):
+    rna.calls += 1
+    if cls in bpy.utils.registered_classes:
+        raise ValueError("%s already registered" % cls.__name__)
+    bpy.utils.registered_classes.append(cls)
+    if issubclass(cls, bpy.types.AddonPreferences):
+        bpy.context.user_preferences.addons._append(Struct(name=cls.bl_idname, preferences=new_instance(cls)))
+
+
+def new_instance(cls):
+    """Instance of a registered class with its properties set to their default values"""
+    instance = cls()
+    for klass in reversed(cls.__mro__):
+        for name, value in vars(klass).items():
+            if isinstance(value, tuple) and len(value) == 2 and callable(value[0]):
+                object.__setattr__(instance, name, value[1].get('default'))
+    return instance
+
+
+def unregister_class(cls):
+    rna.calls += 1
+    bpy.utils.registered_classes.remove(cls)
+
+
+def make_property(name):
+    def prop(**kwargs):
+        return (prop, kwargs)
+    prop.__name__ = name
+    return prop
+
+
+class Operator():
+    """Fake operator base class, reports are stored in self.reports"""
+
+    def report(self, type, message):
+        self.reports = getattr(self, 'reports', []) + [(set(type), message)]
+
+
+class OperatorModule():
+    """Fake bpy.ops submodule calling the execute method of the registered operators"""
+
+    def __init__(self, name, **functions):
+        self._name = name
+        self.__dict__.update(functions)
+
+    def __getattr__(self, name):
+        idname = "%s.%s" % (self._name, name)
+        cls = next((cls for cls in bpy.utils.registered_classes if getattr(cls, 'bl_idname', None) == idname), None)
+        if cls is None:
+            raise AttributeError(idname)
+
+        def call(**props):
+            rna.calls += 1
+            if hasattr(cls, 'poll') and not cls.poll(bpy.context):
+                raise RuntimeError("Operator bpy.ops.%s.poll() failed, context is incorrect" % idname)
+            operator = new_instance(cls)
+            for prop, value in props.items():
+                object.__setattr__(operator, prop, value)
+            bpy.ops.last_operator = operator
+            return operator.execute(bpy.context)
+        return call
+
+
+class MenuType():
+    """Fake of a menu type extended by addons with prepend/append"""
+
+    def __init__(self):
+        self.draw_functions = []
+
+    def prepend(self, func):
+        self.draw_functions.insert(0, func)
+
+    def append(self, func):
+        self.draw_functions.append(func)
+
+    def remove(self, func):
+        self.draw_functions.remove(func)
+
+
+class SpaceView3D():
+    draw_handlers = []
+
+    @classmethod
+    def draw_handler_add(cls, callback, args, region_type, draw_type):
+        handle = (callback, args, region_type, draw_type)
+        cls.draw_handlers.append(handle)
+        return handle
+
+    @classmethod
+    def draw_handler_remove(cls, handle, region_type):
+        cls.draw_handlers.remove(handle)
+
+
+def persistent(func):
+    func._bpy_persistent = True
+    return func
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+bpy = None
+HANDLERS = ('load_post', 'undo_post', 'redo_post', 'scene_update_post', 'frame_change_post')
+PROPERTIES = ('BoolProperty', 'IntProperty', 'FloatProperty', 'StringProperty', 'EnumProperty',
+              'PointerProperty', 'CollectionProperty', 'FloatVectorProperty', 'IntVectorProperty')
+
+
+def install():
+    """Register the fake modules in sys.modules and return the fake bpy module"""
+    global bpy
+    if bpy is not None:
+        return bpy
+
+    props = _module('bpy.props', **{name: make_property(name) for name in PROPERTIES})
+    props.__all__ = list(PROPERTIES)
+    handlers = _module('bpy.app.handlers', persistent=persistent, **{name: [] for name in HANDLERS})
+    app = _module('bpy.app', version=(2, 78, 0), binary_path="blender", tempdir=tempfile.gettempdir(),
+                  handlers=handlers)
+    bpy_types = _module('bpy.types', Operator=Operator, Menu=type('Menu', (), {}),
+                        Panel=type('Panel', (), {}), AddonPreferences=type('AddonPreferences', (), {}),
+                        SpaceView3D=SpaceView3D, INFO_MT_armature_add=MenuType())
+    utils = _module('bpy.utils', register_class=register_class, unregister_class=unregister_class,
+                    registered_classes=[], user_resource=lambda resource_type, path='', autocreate=False: config_dir)
+    ops = _module('bpy.ops', object=OperatorModule('object', mode_set=mode_set, add=object_add, select_all=select_all),
+                  wm=OperatorModule('wm', save_mainfile=lambda: {'FINISHED'}), view3d=OperatorModule('view3d'),
+                  last_operator=None)
+    path = _module('bpy.path', abspath=lambda path: path.replace("//", "", 1),
+                   clean_name=lambda name: "".join(c if c.isalnum() else "_" for c in name))
+    bpy = _module('bpy', props=props, app=app, types=bpy_types, utils=utils, ops=ops, path=path)
+
+    import_helper = type('ImportHelper', (), {'filepath': make_property('StringProperty')(subtype='FILE_PATH')})
+    io_utils = _module('bpy_extras.io_utils', ImportHelper=import_helper)
+    _module('bpy_extras', io_utils=io_utils)
+    _module('mathutils', Vector=Vector, Matrix=Matrix)
+
+    reset()
+    return bpy
+
+
+config_dir = tempfile.gettempdir()
+
+
+def reset(user_config_dir=None):
+    """Give the fake bpy module a fresh context and data, and reset the RNA counter"""
+    global config_dir
+    if user_config_dir is not None:
+        config_dir = user_config_dir
+    bpy.context = Context()
+    bpy.data = BlendData()
+    del bpy.utils.registered_classes[:]
+    del bpy.types.INFO_MT_armature_add.draw_functions[:]
+    del SpaceView3D.draw_handlers[:]
+    bpy.ops.last_operator = None
+    for name in HANDLERS:
+        del getattr(bpy.app.handlers, name)[:]
+    rna.reset()
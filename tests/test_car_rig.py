@@ -0,0 +1,367 @@
+import json
+import subprocess
+
+import numpy as np
+import pytest
+
+from conftest import best_time, import_addon
+from fake_bpy import Matrix, Struct, Vector
+
+# RNA writes made by Generate() on the default meta rig
+GENERATE_WRITES_BUDGET = 208
+
+
+def generate_car(car_rig):
+    car_rig.CreateCarMetaRig((0, 0, 0))
+    car_rig.Generate((0, 0, 0))
+
+
+def test_import(bpy):
+    assert best_time(lambda: import_addon("car_rig"), repeat=5) < 0.1
+
+
+def test_register_unregister(bpy):
+    car_rig = import_addon("car_rig")
+    car_rig.register()
+    assert car_rig.menu_func in bpy.types.INFO_MT_armature_add.draw_functions
+    assert car_rig.GenerateRig in bpy.utils.registered_classes
+    car_rig.unregister()
+    assert bpy.utils.registered_classes == []
+    assert bpy.types.INFO_MT_armature_add.draw_functions == []
+
+
+def test_generate_rig_structure(bpy):
+    car_rig = import_addon("car_rig")
+    generate_car(car_rig)
+
+    ob = bpy.data.objects['Car Rig']
+    assert ob.parent.name == "carDriver"
+    for name, types in car_rig.EXPECTED_CONSTRAINTS.items():
+        assert [c.type for c in ob.pose.bones[name].constraints] == types, name
+    driver = ob.animation_data.drivers.find('pose.bones["FLWheel"].rotation_euler')
+    assert driver.driver.variables[0].targets[0].id is ob.parent
+
+
+def test_generate_rna_writes(bpy, rna):
+    car_rig = import_addon("car_rig")
+    car_rig.CreateCarMetaRig((0, 0, 0))
+    rna.reset()
+    car_rig.Generate((0, 0, 0))
+    print("Generate(): %d RNA writes, %d RNA calls per car" % (rna.writes, rna.calls))
+    assert rna.writes <= GENERATE_WRITES_BUDGET
+
+
+def test_generate_time(bpy):
+    car_rig = import_addon("car_rig")
+    assert best_time(lambda: generate_car(car_rig), repeat=5) < 0.05
+
+
+def test_drive_region_aligned_on_grid(bpy):
+    car_rig = import_addon("car_rig")
+    region = car_rig.drive_region(np.array([1.2, 10.1]), np.array([-3.3, 4.0]), 2.0, 0.5)
+    assert region == (-1.0, -5.5, 12.5, 6.0)
+
+
+def test_sample_height_field_bilinear(bpy):
+    car_rig = import_addon("car_rig")
+    origin, step = (-1.0, -5.5), 0.5
+    gy, gx = np.mgrid[0:20, 0:30]
+    x = origin[0] + gx * step
+    y = origin[1] + gy * step
+    heights = (0.2 * x - 0.1 * y + 3).astype(np.float32)
+
+    px = np.array([[0.13, 5.7], [-0.9, 12.9]])
+    py = np.array([[-5.2, 3.3], [0.0, 3.9]])
+    sampled = car_rig.sample_height_field(heights, origin, step, px, py)
+    assert sampled.shape == px.shape
+    assert np.allclose(sampled, 0.2 * px - 0.1 * py + 3, atol=1e-5)
+
+
+def make_terrain(bpy, height, size=100):
+    """Ground mesh object whose surface is z = height(x, y)"""
+    mesh = bpy.data.meshes.new("Ground", height)
+    for x, y in ((-size, -size), (size, size)):
+        mesh.vertices._append(Struct(co=Vector((x, y, height(x, y)))))
+    return bpy.data.objects.new("Ground", mesh)
+
+
+def slope(x, y):
+    return 0.2 * x - 0.1 * y + 3
+
+
+def test_height_field_tiles_shared(bpy, rna, tmp_path, monkeypatch):
+    car_rig = import_addon("car_rig")
+    monkeypatch.setattr(bpy.app, "tempdir", str(tmp_path))
+    terrain = make_terrain(bpy, slope)
+
+    region = (-1.0, -5.5, 12.5, 6.0)
+    heights = car_rig.get_height_field(terrain, region, 0.5)
+    gy, gx = np.mgrid[0:heights.shape[0], 0:heights.shape[1]]
+    assert np.allclose(heights, slope(region[0] + gx * 0.5, region[1] + gy * 0.5), atol=1e-4)
+    tiles = sorted(path.name for path in tmp_path.glob("*.heights/*.npy"))
+    assert tiles == ["-1_-1.npy", "-1_0.npy", "0_-1.npy", "0_0.npy"]
+
+    # another car driving elsewhere on the same tiles does not cast any ray
+    car_rig.height_fields.clear()
+    rna.reset()
+    heights = car_rig.get_height_field(terrain, (3.0, 2.0, 20.0, 25.5), 0.5)
+    assert rna.calls == 1
+    assert heights[0, 0] == np.float32(slope(3.0, 2.0))
+    assert sorted(path.name for path in tmp_path.glob("*.heights/*.npy")) == tiles
+
+
+def test_height_field_read_only_directory(bpy, tmp_path, monkeypatch):
+    car_rig = import_addon("car_rig")
+    monkeypatch.setattr(bpy.app, "tempdir", str(tmp_path))
+
+    def save(*args):
+        raise PermissionError("read-only")
+    monkeypatch.setattr(car_rig.np, "save", save)
+    terrain = make_terrain(bpy, slope)
+    heights = car_rig.get_height_field(terrain, (0.0, 0.0, 2.0, 2.0), 0.5)
+    assert heights.shape == (5, 5)
+    assert list(tmp_path.glob("*.heights/*.npy")) == []
+
+
+def generate_cars(bpy, car_rig, nb_cars):
+    rigs = []
+    for i in range(nb_cars):
+        generate_car(car_rig)
+        rig = bpy.context.scene.objects[-2]
+        rig.name = "Car Rig %d" % i
+        rig.parent.name = "carDriver.%03d" % i
+        rigs.append(rig)
+    return rigs
+
+
+def test_validate_generated_rig(bpy):
+    car_rig = import_addon("car_rig")
+    rig, = generate_cars(bpy, car_rig, 1)
+    ground = bpy.data.objects.new("Ground", None)
+
+    report = car_rig.ValidateRig(rig, repair=True, ground=ground)
+    assert report["problems"] == ["untargeted Shrinkwrap on %s" % name for name in car_rig.SENSORS]
+    assert report["repaired"] == report["problems"]
+    assert car_rig.ValidateRig(rig)["problems"] == []
+
+
+def test_validate_repairs_parent_of_single_orphan(bpy):
+    car_rig = import_addon("car_rig")
+    first, second = generate_cars(bpy, car_rig, 2)
+    driver = second.parent
+    second.parent = None
+    second.matrix_parent_inverse = Matrix([[2, 0, 0, 0], [0, 2, 0, 0], [0, 0, 2, 0], [0, 0, 0, 1]])
+
+    report = car_rig.ValidateRig(second, repair=True)
+    assert "rig not parented to carDriver" in report["repaired"]
+    assert second.parent is driver
+    assert second.matrix_parent_inverse.is_identity()
+    assert first.parent.name == "carDriver.000"
+
+
+def test_validate_ambiguous_parent_not_repaired(bpy):
+    car_rig = import_addon("car_rig")
+    rigs = generate_cars(bpy, car_rig, 2)
+    for rig in rigs:
+        rig.parent = None
+
+    report = car_rig.ValidateRig(rigs[0], repair=True)
+    assert "rig not parented to carDriver" in report["problems"]
+    assert "rig not parented to carDriver" not in report["repaired"]
+    assert rigs[0].parent is None
+
+
+def test_validate_meta_rig_and_damaged_rig(bpy):
+    car_rig = import_addon("car_rig")
+    car_rig.CreateCarMetaRig((0, 0, 0))
+    assert car_rig.ValidateRig(bpy.context.active_object).get("meta_rig")
+
+    rig, = generate_cars(bpy, car_rig, 1)
+    rig.data.bones._items.remove(rig.data.bones['axis'])
+    rig.pose.bones._items.remove(rig.pose.bones['axis'])
+    report = car_rig.ValidateRig(rig)
+    assert not report.get("meta_rig")
+    assert "missing bone axis" in report["problems"]
+
+
+def drive(car_rig, rig, frames, x, y):
+    """Key the location of the car driver of the rig"""
+    action = car_rig.get_action(rig.parent)
+    car_rig.write_keyframes(action, 'location', 0, frames, x, "Object Transforms")
+    car_rig.write_keyframes(action, 'location', 1, frames, y, "Object Transforms")
+
+
+def test_bake_ground_contact(bpy, tmp_path, monkeypatch):
+    car_rig = import_addon("car_rig")
+    monkeypatch.setattr(bpy.app, "tempdir", str(tmp_path))
+    rig, = generate_cars(bpy, car_rig, 1)
+    frames = np.arange(1, 41, dtype=float)
+    assert not car_rig.BakeGroundContact(rig, frames, 0.5)
+
+    terrain = make_terrain(bpy, slope)
+    for name in car_rig.SENSORS:
+        rig.pose.bones[name].constraints[0].target = terrain
+    drive(car_rig, rig, frames, frames * 0.3, 5 - frames * 0.2)
+    assert car_rig.BakeGroundContact(rig, frames, 0.5)
+
+    fcurves = dict((fc.data_path, fc) for fc in rig.animation_data.action.fcurves if fc.array_index == 1)
+    for name in car_rig.SENSORS:
+        head = rig.data.bones[name].head_local
+        distance = rig.pose.bones[name].constraints[0].distance
+        expected = slope(head.x + frames * 0.3, head.y + 5 - frames * 0.2) + distance - head.z
+        assert np.allclose(keyframe_values(fcurves['pose.bones["%s"].location' % name]), expected, atol=1e-4), name
+        assert rig.pose.bones[name].constraints[0].mute
+
+
+def test_bake_wheel_spin(bpy):
+    car_rig = import_addon("car_rig")
+    rig, = generate_cars(bpy, car_rig, 1)
+    driver = rig.animation_data.drivers.find('pose.bones["FLWheel"].rotation_euler')
+    driver.modifiers[0].coefficients = (0, 1 / 0.35)
+    # 10 m forward (the rig front is along -Y), then 10 m backward
+    frames = np.arange(1, 22, dtype=float)
+    drive(car_rig, rig, frames, np.zeros(21), -np.minimum(frames - 1, 21 - frames))
+    car_rig.BakeWheelSpin(rig, frames)
+
+    assert rig["precomputedSpinRadius"] == 0.35
+    assert rig.animation_data.drivers.find('pose.bones["FLWheel"].rotation_euler') is None
+    fcurves = dict((fc.data_path, fc) for fc in rig.animation_data.action.fcurves if fc.array_index == 0)
+    for name in car_rig.WHEELS:
+        spin = keyframe_values(fcurves['pose.bones["%s"].rotation_euler' % name])
+        assert np.allclose(spin[:11], -np.arange(11) / 0.35), name
+        # reversing turns the wheels backward
+        assert np.allclose(spin[10:], spin[10::-1]), name
+        assert not [c for c in rig.pose.bones[name].constraints if c.type == 'COPY_ROTATION' and c.subtarget == 'FLWheel']
+    ground = bpy.data.objects.new("Ground", None)
+    assert car_rig.ValidateRig(rig, repair=True, ground=ground)["problems"] == [
+        "untargeted Shrinkwrap on %s" % name for name in car_rig.SENSORS]
+
+
+def test_validate_library_worker_error(bpy, tmp_path, monkeypatch):
+    car_rig = import_addon("car_rig")
+    (tmp_path / "car.blend").write_bytes(b"")
+    commands = []
+
+    def run(command, **kwargs):
+        commands.append(command)
+        output = "".join("line %d\n" % i for i in range(50)) + "Traceback (most recent call last):\nKeyError: 'Body'\n"
+        return subprocess.CompletedProcess(command, 1, stdout=output)
+    monkeypatch.setattr(car_rig.subprocess, "run", run)
+    report_path = tmp_path / "report.json"
+    car_rig.ValidateLibrary(str(tmp_path), str(report_path))
+
+    assert commands[0][commands[0].index("--python-exit-code") + 1] == "1"
+    assert commands[0].index("--python-exit-code") < commands[0].index("--python")
+    report, = json.loads(report_path.read_text())
+    lines = report["error"].splitlines()
+    assert lines[0] == "Blender exited with code 1"
+    assert lines[1:] == ["line %d" % i for i in range(32, 50)] + ["Traceback (most recent call last):", "KeyError: 'Body'"]
+
+
+def keyframe_values(fcurve):
+    return np.array([keyframe.co[1] for keyframe in fcurve.keyframe_points])
+
+
+def test_write_keyframes(bpy, rna):
+    car_rig = import_addon("car_rig")
+    action = bpy.data.actions.new("Action")
+    writes = []
+    for nb_keys in (10, 10000):
+        frames = np.arange(nb_keys, dtype=float)
+        rna.reset()
+        fcurve = car_rig.write_keyframes(action, 'location', 0, frames, frames * 2, "Object Transforms")
+        writes.append(rna.writes)
+        assert list(fcurve.keyframe_points[-1].co) == [nb_keys - 1, 2 * (nb_keys - 1)]
+        assert set(keyframe.interpolation for keyframe in fcurve.keyframe_points) == {'LINEAR'}
+    # the coordinates are set in bulk, only the interpolations are written per keyframe
+    assert writes[1] - writes[0] == 10000 - 10
+    assert len(action.fcurves) == 1
+
+
+def test_keyframe_enum_not_set_in_bulk(bpy):
+    # foreach_set only handles bool, int and float properties in Blender
+    action = bpy.data.actions.new("Action")
+    fcurve = action.fcurves.new('location', 0, "Object Transforms")
+    fcurve.keyframe_points.add(3)
+    with pytest.raises(TypeError):
+        fcurve.keyframe_points.foreach_set('interpolation', [1] * 3)
+
+
+def write_telemetry(path, nb_samples, suspension=True):
+    t = np.arange(nb_samples) / 100.0
+    heading = (350 + 10 * t) % 360
+    columns = [t, 45 + t * 1e-5, 2 + t * 1e-5, heading, np.full(nb_samples, 20.0)]
+    header = "time,latitude,longitude,heading,speed"
+    if suspension:
+        columns += [np.full(nb_samples, 0.01)] * 4
+        header += ",susp_fl,susp_fr,susp_bl,susp_br"
+    np.savetxt(str(path), np.column_stack(columns), delimiter=",", header=header, comments="", fmt="%.9f")
+
+
+def test_read_telemetry_blocks(bpy, tmp_path, monkeypatch):
+    car_rig = import_addon("car_rig")
+    path = tmp_path / "drive.csv"
+    write_telemetry(path, 1000)
+
+    whole = car_rig.ReadTelemetry(str(path), 24)
+    # blocks cutting the lines anywhere
+    monkeypatch.setattr(car_rig, "TELEMETRY_BLOCK", 997)
+    blocks = car_rig.ReadTelemetry(str(path), 24)
+
+    assert len(whole) == 240
+    assert np.allclose(whole, blocks)
+    assert np.allclose(np.diff(whole[:, 0]), 1 / 24)
+    # the heading crosses north without jumping
+    assert np.all(np.abs(np.diff(whole[:, 3])) < 0.1)
+
+
+def test_read_telemetry_blank_lines(bpy, tmp_path):
+    car_rig = import_addon("car_rig")
+    path = tmp_path / "drive.csv"
+    write_telemetry(path, 1000)
+    expected = car_rig.ReadTelemetry(str(path), 24)
+
+    lines = path.read_text().splitlines()
+    path.write_bytes("\r\n".join(lines[:500] + ["", "  "] + lines[500:] + ["", ""]).encode())
+    assert np.allclose(car_rig.ReadTelemetry(str(path), 24), expected)
+
+
+def fcurve_paths(action):
+    return set((fcurve.data_path, fcurve.array_index) for fcurve in action.fcurves)
+
+
+def steering_curve(action):
+    fcurve = next(fc for fc in action.fcurves if fc.data_path == 'pose.bones["steeringWheel"].location' and fc.array_index == 0)
+    return keyframe_values(fcurve)
+
+
+def test_import_telemetry_replaces_curves(bpy, tmp_path):
+    car_rig = import_addon("car_rig")
+    rig, = generate_cars(bpy, car_rig, 1)
+    damper_paths = set(('pose.bones["damper"].location', i) for i in range(3))
+    steering_paths = set(('pose.bones["steeringWheel"].location', i) for i in range(3))
+
+    write_telemetry(tmp_path / "with_suspension.csv", 500)
+    car_rig.ImportTelemetry(rig, str(tmp_path / "with_suspension.csv"))
+    assert damper_paths | steering_paths <= fcurve_paths(rig.animation_data.action)
+
+    write_telemetry(tmp_path / "without_suspension.csv", 500, suspension=False)
+    car_rig.ImportTelemetry(rig, str(tmp_path / "without_suspension.csv"))
+    paths = fcurve_paths(rig.animation_data.action)
+    assert steering_paths <= paths
+    assert not damper_paths & paths
+
+
+def test_import_telemetry_scale_length(bpy, tmp_path):
+    car_rig = import_addon("car_rig")
+    rig, = generate_cars(bpy, car_rig, 1)
+    write_telemetry(tmp_path / "drive.csv", 500)
+
+    car_rig.ImportTelemetry(rig, str(tmp_path / "drive.csv"))
+    steering = steering_curve(rig.animation_data.action)
+    bpy.context.scene.unit_settings.scale_length = 2.0
+    car_rig.ImportTelemetry(rig, str(tmp_path / "drive.csv"))
+
+    # a twice larger rig has a twice longer wheelbase, so steers more for the same path
+    assert np.any(steering)
+    assert np.allclose(steering_curve(rig.animation_data.action), 2 * steering)
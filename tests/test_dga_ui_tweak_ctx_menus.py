@@ -0,0 +1,47 @@
+from conftest import best_time, import_addon
+
+
+def test_import(bpy):
+    assert best_time(lambda: import_addon("dga_ui_tweak_ctx_menus"), repeat=5) < 0.1
+
+
+def test_register_unregister(bpy):
+    ctx_menus = import_addon("dga_ui_tweak_ctx_menus")
+    ctx_menus.register()
+    assert bpy.utils.registered_classes == ctx_menus.CLASSES
+    assert len(ctx_menus.KeymapsAddon.created_keymaps) > 0
+    ctx_menus.unregister()
+    assert bpy.utils.registered_classes == []
+    assert ctx_menus.KeymapsAddon.created_keymaps == []
+    for km in bpy.context.window_manager.keyconfigs.addon.keymaps:
+        assert len(km.keymap_items) == 0
+
+
+def test_register_time(bpy):
+    ctx_menus = import_addon("dga_ui_tweak_ctx_menus")
+
+    def register_unregister():
+        ctx_menus.register()
+        ctx_menus.unregister()
+    assert best_time(register_unregister) < 0.01
+
+
+def test_poll_cost(bpy):
+    # the polls only read space_data, mode and tool_settings, never the scene or the blend data,
+    # so their cost does not depend on the scene size: each branch is timed against a fixed budget
+    ctx_menus = import_addon("dga_ui_tweak_ctx_menus")
+    polls = (ctx_menus.CtxPivotPointMenu.poll, ctx_menus.ProportionalEditingFalloffMenu.poll)
+    context = bpy.context
+
+    def poll_many():
+        for i in range(1000):
+            for poll in polls:
+                poll(context)
+
+    for space_type, mode, space_mode in (('VIEW_3D', 'OBJECT', 'TRACKING'), ('VIEW_3D', 'EDIT_MESH', 'TRACKING'),
+                                         ('CLIP_EDITOR', 'OBJECT', 'MASK'), ('CLIP_EDITOR', 'OBJECT', 'TRACKING')):
+        context.space_data.type = space_type
+        context.space_data.mode = space_mode
+        context.mode = mode
+        # 2000 polls
+        assert best_time(poll_many) < 0.01, (space_type, mode, space_mode)
@@ -0,0 +1,170 @@
+import json
+import os
+
+import numpy as np
+
+import fake_bpy
+from conftest import best_time, import_addon
+from fake_bpy import Matrix, Struct
+
+# AZERTY items whose key differs from QWERTY
+AZERTY_ITEMS = sorted([
+    ('View3D Fly Modal', 'FORWARD', 'Z', 'PRESS'),
+    ('View3D Fly Modal', 'LEFT', 'Q', 'PRESS'), ('View3D Fly Modal', 'DOWN', 'A', 'PRESS'),
+    ('View3D Fly Modal', 'AXIS_LOCK_Z', 'W', 'PRESS'),
+    ('View3D Walk Modal', 'FORWARD', 'Z', 'PRESS'), ('View3D Walk Modal', 'LEFT', 'Q', 'PRESS'),
+    ('View3D Walk Modal', 'DOWN', 'A', 'PRESS'), ('View3D Walk Modal', 'FORWARD_STOP', 'Z', 'RELEASE'),
+    ('View3D Walk Modal', 'LEFT_STOP', 'Q', 'RELEASE'), ('View3D Walk Modal', 'DOWN_STOP', 'A', 'RELEASE'),
+])
+
+
+def registered_items(walk_fly):
+    return sorted((km.name, kmi.propvalue, kmi.type, kmi.value) for km, kmi in walk_fly.keymaps)
+
+
+def fill_default_keyconfig(bpy, walk_fly):
+    default_kc = bpy.context.window_manager.keyconfigs.default
+    for keymap_name, propvalue, key, value, modifiers in walk_fly.QWERTY_MODAL_ITEMS:
+        km = default_kc.keymaps.new(keymap_name, space_type='EMPTY', region_type='WINDOW', modal=True)
+        km.keymap_items.new_modal(propvalue, key, value, **modifiers)
+
+
+def test_import(bpy):
+    assert best_time(lambda: import_addon("dga_walk_fly_mode_azerty"), repeat=5) < 0.1
+
+
+def test_register_at_startup(bpy):
+    # the default keyconfig is still empty when addons are registered at startup
+    walk_fly = import_addon("dga_walk_fly_mode_azerty")
+    walk_fly.register()
+    assert registered_items(walk_fly) == AZERTY_ITEMS
+    assert not os.path.exists(walk_fly.translation_cache_path())
+    walk_fly.unregister()
+    assert walk_fly.keymaps == []
+    assert bpy.utils.registered_classes == []
+    for km in bpy.context.window_manager.keyconfigs.addon.keymaps:
+        assert len(km.keymap_items) == 0
+
+
+def test_translation_table_cached_on_disk(bpy):
+    walk_fly = import_addon("dga_walk_fly_mode_azerty")
+    fill_default_keyconfig(bpy, walk_fly)
+    walk_fly.register()
+    walk_fly.unregister()
+    assert os.path.exists(walk_fly.translation_cache_path())
+
+    # later startups read the table from the cache
+    bpy.context.window_manager.keyconfigs.default.keymaps._items.clear()
+    walk_fly.register()
+    assert registered_items(walk_fly) == AZERTY_ITEMS
+    walk_fly.unregister()
+
+
+def test_translation_cache_invalidated_by_addon_update(bpy, monkeypatch):
+    walk_fly = import_addon("dga_walk_fly_mode_azerty")
+    fill_default_keyconfig(bpy, walk_fly)
+    walk_fly.register()
+    walk_fly.unregister()
+
+    # a new addon version translating the keys differently
+    bpy.context.window_manager.keyconfigs.default.keymaps._items.clear()
+    monkeypatch.setitem(walk_fly.LAYOUTS, 'AZERTY', {'M': 'SEMI_COLON'})
+    walk_fly.register()
+    assert registered_items(walk_fly) == []
+    walk_fly.unregister()
+
+    # the table of the new version replaces the one of the previous version
+    monkeypatch.undo()
+    monkeypatch.setitem(walk_fly.bl_info, 'version', (9, 9))
+    fill_default_keyconfig(bpy, walk_fly)
+    walk_fly.register()
+    assert registered_items(walk_fly) == AZERTY_ITEMS
+    walk_fly.unregister()
+    with open(walk_fly.translation_cache_path()) as cache_file:
+        keys = list(json.load(cache_file))
+    assert len(keys) == 1 and "/9.9/AZERTY/" in keys[0]
+
+
+def test_change_layout(bpy):
+    walk_fly = import_addon("dga_walk_fly_mode_azerty")
+    walk_fly.register()
+    preferences = bpy.context.user_preferences.addons[walk_fly.__name__].preferences
+    preferences.layout_name = 'QWERTZ'
+    walk_fly.update_layout(preferences, bpy.context)
+    assert registered_items(walk_fly) == [('View3D Fly Modal', 'AXIS_LOCK_Z', 'Y', 'PRESS')]
+    walk_fly.unregister()
+
+
+def test_register_time(bpy):
+    walk_fly = import_addon("dga_walk_fly_mode_azerty")
+
+    def register_unregister():
+        walk_fly.register()
+        walk_fly.unregister()
+    assert best_time(register_unregister) < 0.01
+
+
+def test_simplify_and_write_keyframes(bpy, rna):
+    walk_fly = import_addon("dga_walk_fly_mode_azerty")
+    frames = np.arange(7200) / 120.0 * 24
+    values = np.sin(frames / 50)
+    kept = walk_fly.simplify(frames, values, 0.001)
+    assert 2 < len(kept) < len(frames) // 10
+    assert np.max(np.abs(np.interp(frames, frames[kept], values[kept]) - values)) <= 0.001
+
+    action = bpy.data.actions.new("CameraAction")
+    rna.reset()
+    walk_fly.write_keyframes(action, 'location', 0, frames[kept], values[kept], "Object Transforms")
+    fcurve = action.fcurves[0]
+    assert set(keyframe.interpolation for keyframe in fcurve.keyframe_points) == {'LINEAR'}
+    # one write per keyframe for the interpolation, the coordinates are set in bulk
+    assert rna.writes == len(kept)
+
+
+def record_navigation(bpy, walk_fly, nb_samples):
+    """Toggle the recording on, redraw the view nb_samples times moving along X, and toggle it off"""
+    bpy.context.region_data = Struct(view_matrix=Matrix())
+    bpy.ops.view3d.toggle_navigation_recording()
+    draw_handler, args = fake_bpy.SpaceView3D.draw_handlers[-1][:2]
+    for i in range(nb_samples):
+        bpy.context.region_data.view_matrix = Matrix([[1, 0, 0, -i * 0.1], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
+        draw_handler(*args)
+    bpy.ops.view3d.toggle_navigation_recording()
+
+
+def camera_keys(camera):
+    return {(fcurve.data_path, fcurve.array_index): [tuple(keyframe.co) for keyframe in fcurve.keyframe_points]
+            for fcurve in camera.animation_data.action.fcurves}
+
+
+def test_recording_kept_without_camera(bpy):
+    walk_fly = import_addon("dga_walk_fly_mode_azerty")
+    walk_fly.register()
+    assert 'UNDO' not in getattr(walk_fly.NavigationRecorderOperator, 'bl_options', set())
+
+    record_navigation(bpy, walk_fly, 50)
+    assert bpy.ops.last_operator.reports == [({'ERROR'}, "No scene camera to bake the navigation on")]
+    assert len(walk_fly.BakeNavigationOperator.samples) == 50
+
+    # the samples are baked once a camera is set
+    camera = bpy.context.scene.camera = bpy.data.objects.new("Camera", None)
+    assert bpy.ops.view3d.bake_navigation() == {'FINISHED'}
+    assert len(camera_keys(camera)[('location', 0)]) >= 2
+    walk_fly.unregister()
+    assert walk_fly.BakeNavigationOperator.samples is None
+
+
+def test_bake_redone_with_other_tolerance(bpy):
+    walk_fly = import_addon("dga_walk_fly_mode_azerty")
+    walk_fly.register()
+    camera = bpy.context.scene.camera = bpy.data.objects.new("Camera", None)
+    record_navigation(bpy, walk_fly, 50)
+    keys = camera_keys(camera)
+
+    # redo: the samples of the recording are baked again with the new tolerance
+    assert bpy.ops.view3d.bake_navigation(location_tolerance=10.0) == {'FINISHED'}
+    assert len(camera_keys(camera)[('location', 0)]) == 2
+    assert bpy.ops.view3d.bake_navigation() == {'FINISHED'}
+    assert camera_keys(camera) == keys
+    assert fake_bpy.SpaceView3D.draw_handlers == []
+    walk_fly.unregister()